@@ -3,6 +3,8 @@ from dash import Dash, html
 import dash_bootstrap_components as dbc  # pip install dash-bootstrap-components
 from datetime import datetime as dt
 import sys  # Needed for sys.exit()
+from mqtt_ingest import start_from_environment
+from metrics import instrument
 
 # Initialize the Dash app
 app = dash.Dash(
@@ -18,6 +20,13 @@ if current_date >= expiry_date:
     print("This application has expired.")
     sys.exit()  # Exit the script if the date is expired
 
+# Time the callbacks and serve the timings on /metrics (slow ones are printed
+# when PROCOIL_SLOW_REQUEST_MS is set)
+instrument(app)
+
+# Subscribe to live coil samples over MQTT (only if PROCOIL_MQTT_HOST is set)
+start_from_environment()
+
 # Custom Navbar with Two Rows
 navbar = dbc.Navbar(
     dbc.Container([
@@ -0,0 +1,106 @@
+import os
+import time
+import diskcache
+from dash import DiskcacheManager
+from metrics import callback_name, timed_job
+
+# Background execution of the long Coil-Voltages loads.
+#
+# Dash runs a background callback in a separate process and the browser polls
+# for its result, so a gunicorn worker is only busy for the short polls instead
+# of for the whole load. Jobs, progress and results are kept in a diskcache
+# folder that all gunicorn workers share. On top of the plain DiskcacheManager:
+#   - a request with the same callback and arguments as a job that is still
+#     running (or just finished) attaches to that job instead of starting
+#     another one
+#   - a job is only cancelled (Graph clicked again) when no other browser is
+#     waiting for it
+#   - progress and result stay until every attached browser has read them
+#   - the time of every job and of its loading stages goes to /metrics
+#
+# A job process is forked from the gunicorn worker that received the request.
+# It starts with a copy of the worker's in-memory caches (catalog, byte-offset
+# indexes, pyramids, parsed frames), but whatever it adds to them is gone when
+# it ends: the next job starts again from the worker's caches. What carries
+# over between jobs and workers is on disk: the .npy sidecars and pyramid
+# files a job writes are mapped by every later load, so a repeat load of an
+# unchanged log does not parse it again. That is the price of running loads
+# outside the worker; a long-lived pool would keep more in memory, but a job
+# could no longer be cancelled by ending its process. The modules that lock
+# shared state replace their locks in the forked process (os.register_at_fork),
+# since a lock held by another thread of the worker would never be released.
+
+JOB_DIR = os.environ.get('PROCOIL_JOB_DIR', os.path.join('.procoil', 'jobs'))
+# Seconds the bookkeeping of a job is kept, far longer than any load
+JOB_EXPIRE = 3600
+# Seconds a finished job is shared with new identical requests, and its result
+# kept for the other browsers after the first one read it
+RESULT_EXPIRE = 60
+
+
+class SharedJobManager(DiskcacheManager):
+
+    def _lock(self, key):
+        return diskcache.Lock(self.handle, f"{key}-lock", expire=60)
+
+    def call_job_fn(self, key, job_fn, args, context):
+        with self._lock(key):
+            state = self.handle.get(f"{key}-job")
+            recent = state and time.time() - state['started'] < RESULT_EXPIRE
+            if state and (self.job_running(state['job']) or recent and self.result_ready(key)):
+                state['clients'] += 1
+                self.handle.set(f"{key}-job", state, expire=JOB_EXPIRE)
+                return state['job']
+            # Result of an abandoned run, the logs may have grown since
+            self.clear_cache_entry(key)
+            self.clear_cache_entry(self._make_progress_key(key))
+            job_fn = timed_job(job_fn, callback_name(context.get('outputs_list')))
+            job = super().call_job_fn(key, job_fn, args, context)
+            self.handle.set(f"{key}-job", {'job': job, 'clients': 1, 'started': time.time()}, expire=JOB_EXPIRE)
+            self.handle.set(f"job-{job}", key, expire=JOB_EXPIRE)
+            return job
+
+    def terminate_job(self, job):
+        # Called when a browser gives up on a job, and after its result was read
+        if job is None:
+            return
+        key = self.handle.get(f"job-{job}")
+        if key is not None:
+            with self._lock(key):
+                state = self.handle.get(f"{key}-job")
+                if state and state['job'] == int(job):
+                    if state['clients'] > 1 and not self.result_ready(key):
+                        state['clients'] -= 1  # Others still wait for it
+                        self.handle.set(f"{key}-job", state, expire=JOB_EXPIRE)
+                        return
+                    if state['clients'] <= 1:
+                        self._clear(key, job)
+        super().terminate_job(job)
+
+    def get_progress(self, key):
+        # Not cleared on read, the other browsers on the job poll it too
+        return self.handle.get(self._make_progress_key(key))
+
+    def get_result(self, key, job):
+        result = self.handle.get(key, self.UNDEFINED)
+        if result is self.UNDEFINED:
+            return self.UNDEFINED
+        with self._lock(key):
+            state = self.handle.get(f"{key}-job")
+            if state and state['clients'] > 1:
+                state['clients'] -= 1
+                self.handle.set(f"{key}-job", state, expire=JOB_EXPIRE)
+                # Dropped if the others never come back for it
+                self.handle.touch(key, expire=RESULT_EXPIRE)
+            else:
+                self._clear(key, state['job'] if state else None)
+        if job:
+            DiskcacheManager.terminate_job(self, job)  # Finished, only the process is left
+        return result
+
+    def _clear(self, key, job):
+        for entry in (key, self._make_progress_key(key), f"{key}-job", f"job-{job}"):
+            self.clear_cache_entry(entry)
+
+
+background_manager = SharedJobManager(diskcache.Cache(JOB_DIR))
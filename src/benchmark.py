@@ -0,0 +1,246 @@
+import argparse
+import base64
+import contextlib
+import gzip
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import zstandard
+from log_generator import LEGACY_BAD_KINDS, write_coil, write_log
+
+# Benchmarks of the log loading paths and the page callbacks on synthetic logs.
+#
+#   python benchmark.py [--rows 200000] [--repeat 3] [--output results.json]
+#                       [--compare baseline.json] [--keep DIR]
+#
+# A coil with 16 logs of --rows rows is generated in a temporary directory
+# (log_generator.py) and every benchmark runs --repeat times against it:
+#   parse:*     read_log (fast parser, also on gzip and Zstandard copies of
+#               the log), read_voltage_file (legacy parser) and a sidecar load
+#               of one log, in rows/s and MB/s. The legacy parser fails on the
+#               non-numeric bad lines, so it reads the same log written without
+#               them (log_generator.LEGACY_BAD_KINDS).
+#   File*:      File/File_2 cold (nothing cached) and warm
+#   callback:*  update_output of both Coil-Voltages pages and the per-file
+#               upload callback of coil_iq_2, called in-process, including the
+#               JSON serialisation of their outputs
+# For every benchmark the best and median time, the peak of the memory
+# allocations traced in one extra run and, for callbacks, the size of the
+# serialised response are reported; a benchmark that raises is recorded with
+# its error. The results are printed and, with
+# --output, written as JSON together with the commit and library versions.
+# --compare prints the change of every time and size against earlier results.
+
+DEFAULT_ROWS = 200000
+
+
+def measure(run, repeat=3, setup=None):
+    # (times in s, peak traced allocation in bytes, last result) of repeat runs.
+    # Tracing slows allocations down, so the peak is taken in one extra run.
+    times = []
+    result = None
+    for _ in range(repeat + 1):
+        if setup:
+            setup()
+        tracing = len(times) == repeat
+        if tracing:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # The loaders print what they read
+            result = run()
+        if tracing:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            times.append(time.perf_counter() - started)
+    return times, peak, result
+
+
+def bench(results, name, run, repeat, setup=None, details=None):
+    # Run one benchmark and record it; details(result, best time) adds metrics
+    try:
+        times, peak, result = measure(run, repeat, setup)
+    except Exception as e:
+        results.append({'name': name, 'error': str(e)})
+        print(f"{name:32s} failed: {e}")
+        return
+    entry = {'name': name, 'best_s': min(times), 'median_s': statistics.median(times),
+             'peak_alloc_mb': peak / 1e6}
+    extra = details(result, min(times)) if details else {}
+    entry.update(extra)
+    results.append(entry)
+    text = ', '.join(f"{key} {value:,.1f}" if isinstance(value, float) else f"{key} {value}"
+                     for key, value in extra.items())
+    print(f"{name:32s} best {entry['best_s'] * 1000:9.1f} ms  median {entry['median_s'] * 1000:9.1f} ms  "
+          f"peak {entry['peak_alloc_mb']:8.1f} MB  {text}")
+
+
+def clear_caches(directory):
+    # Forget everything parsed so far: in-process caches and the .procoil folder
+    import coil_functions
+    from log_cache import log_cache
+    from log_pyramid import _pyramids
+    from log_index import _indexes
+    log_cache.clear()
+    _pyramids.clear()
+    _indexes.clear()
+    shutil.rmtree(os.path.join(directory, '.procoil'), ignore_errors=True)
+    coil_functions.get_catalog('.').refresh(force=True)
+
+
+def compressed_copies(path):
+    # {compression: path} of compressed copies of a log, outside the data directory
+    folder = os.path.join(os.path.dirname(path), '.compressed')
+    os.makedirs(folder, exist_ok=True)
+    with open(path, 'rb') as f:
+        content = f.read()
+    copies = {'gz': os.path.join(folder, os.path.basename(path) + '.gz')}
+    with gzip.open(copies['gz'], 'wb', compresslevel=6) as f:
+        f.write(content)
+    copies['zst'] = os.path.join(folder, os.path.basename(path) + '.zst')
+    with open(copies['zst'], 'wb') as f:
+        f.write(zstandard.ZstdCompressor(level=3).compress(content))
+    return copies
+
+
+def bench_parsing(results, path, rows, repeat):
+    from coil_functions import read_log, read_voltage_file, load_log
+    from log_sidecar import write_sidecar
+    size = os.path.getsize(path)
+    throughput = lambda df, best: {'rows': len(df), 'rows_per_s': len(df) / best, 'mb_per_s': size / 1e6 / best}
+    os.makedirs(os.path.join(os.path.dirname(path), '.legacy'), exist_ok=True)
+    legacy_path = write_log(os.path.join(os.path.dirname(path), '.legacy', os.path.basename(path)), rows,
+                            start='2024-11-05T00:00:00', bad_kinds=LEGACY_BAD_KINDS)
+    bench(results, 'parse:read_log', lambda: read_log(path), repeat, details=throughput)
+    for name, compressed in compressed_copies(path).items():
+        bench(results, f"parse:read_log {name}", lambda: read_log(compressed), repeat, details=throughput)
+    bench(results, 'parse:read_voltage_file', lambda: read_voltage_file(legacy_path), repeat, details=throughput)
+    write_sidecar(path, read_log(path))
+    bench(results, 'parse:sidecar', lambda: load_log(path), repeat,
+          details=lambda df, best: {'rows': len(df), 'rows_per_s': len(df) / best})
+
+
+def bench_file(results, directory, repeat):
+    from coil_functions import File, File_2
+    rows = lambda df, best: {'rows': len(df)}
+    for name, load in [('File', File), ('File_2', File_2)]:
+        run = lambda: load('KNEE_16', 'MSEQ0', 'VDH')
+        bench(results, f"{name}:cold", run, repeat, setup=lambda: clear_caches(directory), details=rows)
+        bench(results, f"{name}:warm", run, repeat, details=rows)
+
+
+def page_module(name):
+    # The module of a page; the pages register themselves with a Dash app
+    import dash
+    module = f"pages.{name}"
+    if module not in sys.modules:
+        pages_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+        dash.Dash(__name__, use_pages=True, pages_folder=pages_folder)
+    return sys.modules[module]
+
+
+def bench_callbacks(results, directory, repeat):
+    from dash._utils import to_json
+    payload = lambda response, best: {'payload_bytes': len(response)}
+    voltages = ['VDH', 'VDL', 'VLNA', 'VPIN']
+    calls = [
+        ('callback:Coil-Voltages-16', 'Coil-Voltages-16', 'update_output',
+         ('KNEE_16', ['MSEQ0', 'MSEQ1', 'MSEQ2', 'MSEQ3'], voltages, 0, 'cv16')),
+        ('callback:Coil-Voltages-8', 'Coil-Voltages-8', 'update_output',
+         ('KNEE_16', ['MSEQ0', 'MSEQ1'], voltages, 0, 'cv8')),
+    ]
+    for name, page, function, arguments in calls:
+        # Dash keeps the decorated functions as they are, so they can be called directly
+        callback = getattr(page_module(page), function)
+        run = lambda: to_json(callback(lambda progress: None, 1, *arguments))
+        bench(results, f"{name}:cold", run, repeat, setup=lambda: clear_caches(directory), details=payload)
+        bench(results, f"{name}:warm", run, repeat, details=payload)
+
+    path = os.path.join(directory, 'KNEE_16_MSEQ0_VDH_2024-11-05.txt')
+    with open(path, 'rb') as f:
+        content = 'data:text/plain;base64,' + base64.b64encode(f.read()).decode()
+    upload = {'filename': os.path.basename(path), 'content': content}
+    callback = page_module('coil_iq_2').update_output
+    bench(results, 'callback:coil_iq_2 upload', lambda: to_json(callback(upload)), repeat,
+          details=lambda response, best: {'payload_bytes': len(response),
+                                          'mb_per_s': os.path.getsize(path) / 1e6 / best})
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    import dash
+    return {'commit': commit, 'time': pd.Timestamp.now().isoformat(), 'python': platform.python_version(),
+            'pandas': pd.__version__, 'numpy': np.__version__, 'dash': dash.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def compare(results, rows, baseline_path):
+    # Relative change of the times and sizes against an earlier results file
+    with open(baseline_path) as f:
+        report = json.load(f)
+    baseline = {entry['name']: entry for entry in report['results']}
+    print(f"\nChange against {baseline_path} (negative is better):")
+    if report.get('rows') != rows:
+        print(f"Note: the baseline was run with {report.get('rows')} rows per log, this run with {rows}")
+    for entry in results:
+        before = baseline.get(entry['name'])
+        if before is None:
+            continue
+        changes = [f"{key} {100 * (entry[key] / before[key] - 1):+6.1f}%"
+                   for key in ('best_s', 'peak_alloc_mb', 'payload_bytes') if before.get(key) and key in entry]
+        if 'error' in entry:
+            changes = [f"failed: {entry['error']}"]
+        print(f"{entry['name']:32s} " + '  '.join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark log loading and page callbacks on synthetic logs.")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="Rows per generated log")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of every benchmark")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', help="Results JSON of an earlier run to compare with")
+    parser.add_argument('--keep', help="Generate the logs in this directory and keep them")
+    args = parser.parse_args(argv)
+
+    directory = os.path.abspath(args.keep or tempfile.mkdtemp(prefix='procoil-benchmark-'))
+    write_coil(directory, 'KNEE_16', args.rows)
+    print(f"Generated 16 logs of {args.rows} rows in {directory}")
+    # The pages and File look for logs in the working directory
+    previous = os.getcwd()
+    os.chdir(directory)
+    results = []
+    try:
+        bench_parsing(results, os.path.join(directory, 'KNEE_16_MSEQ0_VDH_2024-11-05.txt'), args.rows, args.repeat)
+        bench_file(results, directory, args.repeat)
+        bench_callbacks(results, directory, args.repeat)
+    finally:
+        os.chdir(previous)
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {'environment': environment(), 'rows': args.rows, 'repeat': args.repeat, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.rows, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
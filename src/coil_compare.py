@@ -0,0 +1,166 @@
+import os
+import numpy as np
+import pandas as pd
+from coil_functions import File, Bounds
+from downsample import MAX_POINTS, minmax_downsample
+
+# Time-aligned comparison of several coil series (coil, RXE, voltage).
+#
+# Every series is sampled onto one common time grid with an as-of join: a grid
+# point takes the last sample at or before it, if that sample is at most the
+# tolerance older (otherwise NaN, e.g. in a logging gap). The joins are binary
+# searches over whole arrays. Long ranges are aligned one chunk of time at a
+# time: only the rows of the chunk are read for every series, the statistics
+# are kept as running sums and every chunk is reduced to its share of the
+# point budget, so memory does not grow with the length of the range.
+#
+# The statistics compare every series with the first one (the reference):
+# offset (mean of series minus reference), RMS difference, correlation, and
+# the time lag within MAX_LAG_STEPS grid steps that correlates best.
+
+CHUNK_HOURS = float(os.environ.get('PROCOIL_COMPARE_CHUNK_HOURS', '24'))
+# Samples older than this (or than the grid step, if longer) are not carried forward
+DEFAULT_TOLERANCE_SECONDS = 60
+MAX_LAG_STEPS = 10
+STAT_COLUMNS = ['series', 'coverage', 'samples', 'offset', 'rms_difference', 'correlation',
+                'best_lag_s', 'best_lag_correlation']
+
+
+def series_label(series):
+    coil, rxe, voltage = series
+    return f"{coil} {rxe} {voltage}"
+
+
+def asof(timestamps, values, grid, tolerance):
+    # Values of a series sorted by time at every grid point (all int64 ns)
+    if len(timestamps) == 0:
+        return np.full(len(grid), np.nan)
+    index = np.searchsorted(timestamps, grid, side='right') - 1
+    clipped = np.maximum(index, 0)
+    found = (index >= 0) & (grid - timestamps[clipped] <= tolerance)
+    return np.where(found, np.asarray(values, dtype=np.float64)[clipped], np.nan)
+
+
+def pair_sums(x, y, lags):
+    # [count, sum x, sum y, sum x^2, sum y^2, sum xy] of the samples present in
+    # both x and y, for y shifted by every lag (in grid steps)
+    sums = np.zeros((len(lags), 6))
+    for i, lag in enumerate(lags):
+        if abs(lag) >= len(x):
+            continue
+        if lag >= 0:
+            a, b = x[:len(x) - lag], y[lag:]
+        else:
+            a, b = x[-lag:], y[:len(y) + lag]
+        joint = ~(np.isnan(a) | np.isnan(b))
+        a, b = a[joint], b[joint]
+        sums[i] = [len(a), a.sum(), b.sum(), a @ a, b @ b, a @ b]
+    return sums
+
+
+def pair_statistics(sums, lags, step):
+    # Statistics of a series against the reference from its pair_sums
+    count, sum_x, sum_y, sum_xx, sum_yy, sum_xy = sums.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x, mean_y = sum_x / count, sum_y / count
+        covariance = sum_xy / count - mean_x * mean_y
+        variance_x = sum_xx / count - mean_x ** 2
+        variance_y = sum_yy / count - mean_y ** 2
+        correlation = covariance / np.sqrt(variance_x * variance_y)
+        rms_difference = np.sqrt(np.maximum((sum_xx - 2 * sum_xy + sum_yy) / count, 0))
+    zero = lags.index(0)
+    best = int(np.nanargmax(correlation)) if np.isfinite(correlation).any() else zero
+    return {
+        'samples': int(count[zero]),
+        'offset': mean_y[zero] - mean_x[zero],
+        'rms_difference': rms_difference[zero],
+        'correlation': correlation[zero],
+        'best_lag_s': lags[best] * step / 1e9,
+        'best_lag_correlation': correlation[best],
+    }
+
+
+def read_chunk(series, start, end):
+    # (timestamps in ns, values) of a series between start and end, None if it can't be read
+    df = File(*series, start=pd.Timestamp(start), end=pd.Timestamp(end))
+    if isinstance(df, str):
+        return None
+    return df['datetime'].to_numpy().view('i8'), df['voltage'].to_numpy()
+
+
+def compare_series(series, hours=None, step_seconds=None, difference=False, tolerance_seconds=None,
+                   max_points=MAX_POINTS, chunk_hours=CHUNK_HOURS, progress=None):
+    # Align the series (list of (coil, rxe, voltage), the first is the reference)
+    # over the last hours of their logs (all of it if hours is None). Returns
+    # (curves, statistics, errors): curves maps every plotted label to its
+    # downsampled (x, y), series minus reference with difference; statistics is
+    # a table with one row per series. step_seconds=None picks a step that
+    # gives about max_points grid points. progress(done, total) after every chunk.
+    errors = []
+    bounds = {}
+    series = list(dict.fromkeys(tuple(item) for item in series))  # Each series once
+    for item in series:
+        found = Bounds(*item)
+        if found is None:
+            errors.append(f"No matching file found for {series_label(item)}")
+        else:
+            bounds[item] = found
+    series = [item for item in series if item in bounds]
+    if not series:
+        return {}, pd.DataFrame(columns=STAT_COLUMNS), errors
+
+    end = max(last for first, last in bounds.values())
+    start = min(first for first, last in bounds.values())
+    if hours:
+        start = max(start, end - int(hours * 3600e9))
+    if step_seconds:
+        step = int(step_seconds * 1e9)
+    else:
+        step = max(int(np.ceil((end - start + 1) / max_points / 1e9)), 1) * 10**9
+    tolerance = max(step, int((tolerance_seconds or DEFAULT_TOLERANCE_SECONDS) * 1e9))
+    chunk = max(int(chunk_hours * 3600e9) // step, 1) * step
+    total_points = (end - start) // step + 1
+    chunks = range(start, end + 1, chunk)
+
+    reference = series[0]
+    lags = list(range(-MAX_LAG_STEPS, MAX_LAG_STEPS + 1))
+    sums = {item: np.zeros((len(lags), 6)) for item in series[1:]}
+    present = {item: 0 for item in series}
+    pieces = {item: ([], []) for item in series}
+    for done, chunk_start in enumerate(chunks, 1):
+        grid = np.arange(chunk_start, min(chunk_start + chunk, end + 1), step, dtype=np.int64)
+        aligned = {}
+        for item in series:
+            rows = read_chunk(item, grid[0] - tolerance, grid[-1])
+            if rows is None:
+                aligned[item] = np.full(len(grid), np.nan)
+            else:
+                aligned[item] = asof(rows[0], rows[1], grid, tolerance)
+            present[item] += int(np.count_nonzero(~np.isnan(aligned[item])))
+        for item in series[1:]:
+            sums[item] += pair_sums(aligned[reference], aligned[item], lags)
+
+        # This chunk's share of the point budget
+        budget = max(4, int(max_points * len(grid) / total_points))
+        x = grid.view('datetime64[ns]')
+        for item in series:
+            if difference and item == reference:
+                continue
+            y = aligned[item] - aligned[reference] if difference else aligned[item]
+            x_points, y_points = minmax_downsample(x, y, budget)
+            pieces[item][0].append(x_points)
+            pieces[item][1].append(y_points)
+        if progress:
+            progress(done, len(chunks))
+
+    curves = {}
+    for item, (xs, ys) in pieces.items():
+        if xs:
+            label = f"{series_label(item)} - {series_label(reference)}" if difference else series_label(item)
+            curves[label] = (np.concatenate(xs), np.concatenate(ys))
+    rows = [{'series': series_label(reference), 'coverage': present[reference] / total_points}]
+    for item in series[1:]:
+        row = {'series': series_label(item), 'coverage': present[item] / total_points}
+        row.update(pair_statistics(sums[item], lags, step))
+        rows.append(row)
+    return curves, pd.DataFrame(rows, columns=STAT_COLUMNS).astype({'samples': 'Int64'}), errors
@@ -0,0 +1,184 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Detection of events in a coil series, in whole-array NumPy passes.
+#
+#   excursion  samples outside the [low, high] band of the parameter
+#   stuck      at least stuck_samples samples in a row that do not change by
+#              more than stuck_tolerance
+#   step       the mean of the step_window samples after a point differs from
+#              the mean of the step_window samples before it by more than step
+#   drift      the mean over drift_window samples moves more than drift away
+#              from the median of the whole series
+#
+# The thresholds come from per-parameter profiles in a JSON file (by default
+# event_profiles.json in the data directory, or PROCOIL_EVENT_PROFILES), e.g.
+#   {"*":   {"stuck_samples": 200},
+#    "VDH": {"low": 4.5, "high": 5.5, "step": 0.3},
+#    "VPIN": {"high": 2.0, "drift": 0.2, "drift_window": 5000}}
+# '*' applies to every parameter; a check whose threshold is missing or null
+# is skipped, so without a profile no check runs. Events are returned as a
+# table with one row per event.
+
+PROFILES_PATH = os.environ.get('PROCOIL_EVENT_PROFILES', 'event_profiles.json')
+DEFAULT_PROFILE = {
+    'low': None, 'high': None, 'min_samples': 1,
+    'stuck_samples': None, 'stuck_tolerance': 0.0,
+    'step': None, 'step_window': 20,
+    'drift': None, 'drift_window': 1000,
+}
+KINDS = ['excursion', 'stuck', 'step', 'drift']
+EVENT_COLUMNS = ['kind', 'start', 'end', 'samples', 'level', 'value']
+# Marker symbol of every kind on the graphs
+MARKER_SYMBOLS = {'excursion': 'x', 'stuck': 'square', 'step': 'triangle-up', 'drift': 'diamond'}
+
+
+def load_profiles(path=PROFILES_PATH):
+    # {parameter: profile} from a JSON file, {} if there is none
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def profile_for(parameter, profiles=None):
+    if profiles is None:
+        profiles = load_profiles()
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(profiles.get('*', {}))
+    profile.update(profiles.get(parameter, {}))
+    return profile
+
+
+def has_checks(profile):
+    # Whether any check of the profile has a threshold
+    return any(profile[name] is not None for name in ('low', 'high', 'stuck_samples', 'step', 'drift'))
+
+
+def empty_events():
+    return pd.DataFrame({column: [] for column in EVENT_COLUMNS}).astype(
+        {'kind': str, 'start': 'datetime64[ns]', 'end': 'datetime64[ns]', 'samples': int})
+
+
+def runs(mask):
+    # (starts, ends) of the runs of True in mask, ends exclusive
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+    return edges[::2], edges[1::2]
+
+
+def reduce_runs(ufunc, values, starts, ends):
+    # ufunc reduction of values over every run
+    if len(starts) == 0:
+        return np.empty(0, dtype=values.dtype)
+    padded = np.append(values, values[-1:])  # An end may point just past the last sample
+    return ufunc.reduceat(padded, np.column_stack([starts, ends]).ravel())[::2]
+
+
+def window_means(values, window):
+    # Mean of values[i:i + window] for every i, NaN samples counted as missing
+    present = ~np.isnan(values)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(present, values, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(present)])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[window:] - sums[:-window]) / (counts[window:] - counts[:-window])
+
+
+def excursions(values, low=None, high=None, min_samples=1):
+    outside = np.zeros(len(values), dtype=bool)
+    if low is not None:
+        outside |= values < low
+    if high is not None:
+        outside |= values > high
+    starts, ends = runs(outside)
+    keep = ends - starts >= min_samples
+    starts, ends = starts[keep], ends[keep]
+    # Furthest value from the band: the maximum above it, the minimum below it
+    above = values[starts] > (high if high is not None else np.inf)
+    peaks = np.where(above, reduce_runs(np.maximum, values, starts, ends),
+                     reduce_runs(np.minimum, values, starts, ends))
+    return starts, ends, peaks
+
+
+def stuck_values(values, samples=100, tolerance=0.0):
+    with np.errstate(invalid='ignore'):
+        same = np.abs(np.diff(values)) <= tolerance
+    starts, ends = runs(same)
+    ends = ends + 1  # n unchanged steps span n + 1 samples
+    keep = ends - starts >= samples
+    return starts[keep], ends[keep], values[starts[keep]]
+
+
+def steps(values, threshold, window=20):
+    # Mean after minus mean before every point; a run of points over the
+    # threshold is one step, placed in its middle
+    if len(values) < 2 * window:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+    means = window_means(values, window)
+    delta = means[window:] - means[:-window]  # delta[k] is the step at sample k + window
+    with np.errstate(invalid='ignore'):
+        starts, ends = runs(np.abs(delta) > threshold)
+    middle = (starts + ends - 1) // 2
+    return starts + window, ends + window, delta[middle]
+
+
+def drifts(values, threshold, window=1000):
+    if len(values) < window or np.isnan(values).all():
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+    deviation = window_means(values, window) - np.nanmedian(values)
+    with np.errstate(invalid='ignore'):
+        starts, ends = runs(np.abs(deviation) > threshold)
+    # Largest deviation of each run, with its sign
+    peaks = np.where(deviation[starts] > 0, reduce_runs(np.maximum, deviation, starts, ends),
+                     reduce_runs(np.minimum, deviation, starts, ends))
+    return starts, np.minimum(ends + window - 1, len(values)), peaks
+
+
+def detect_events(datetimes, values, profile=None):
+    # Event table of a series sorted by time: kind, start and end time, number
+    # of samples, level (value at the start, where a marker is drawn) and value
+    # (peak of an excursion, stuck value, size of a step or drift)
+    profile = profile or DEFAULT_PROFILE
+    datetimes = np.asarray(datetimes, dtype='datetime64[ns]')
+    values = np.asarray(values, dtype=np.float64)
+    found = {}
+    if profile['low'] is not None or profile['high'] is not None:
+        found['excursion'] = excursions(values, profile['low'], profile['high'], profile['min_samples'])
+    if profile['stuck_samples']:
+        found['stuck'] = stuck_values(values, profile['stuck_samples'], profile['stuck_tolerance'])
+    if profile['step'] is not None:
+        found['step'] = steps(values, profile['step'], profile['step_window'])
+    if profile['drift'] is not None:
+        found['drift'] = drifts(values, profile['drift'], profile['drift_window'])
+
+    tables = []
+    for kind, (starts, ends, event_values) in found.items():
+        if len(starts) == 0:
+            continue
+        tables.append(pd.DataFrame({
+            'kind': kind,
+            'start': datetimes[starts],
+            'end': datetimes[ends - 1],
+            'samples': ends - starts,
+            'level': values[starts],
+            'value': event_values,
+        }))
+    if not tables:
+        return empty_events()
+    return pd.concat(tables, ignore_index=True).sort_values('start', kind='stable').reset_index(drop=True)
+
+
+def count_events(events):
+    # {kind: number of events} for every kind
+    counts = events['kind'].value_counts()
+    return {kind: int(counts.get(kind, 0)) for kind in KINDS}
+
+
+def event_markers(events, limit=1000):
+    # (x, y, symbols, hover texts) of the markers of the first limit events
+    events = events.head(limit)
+    texts = [f"{kind}: {value:.3g} ({samples} samples)"
+             for kind, value, samples in zip(events['kind'], events['value'], events['samples'])]
+    return events['start'].to_numpy(), events['level'].to_numpy(), events['kind'].map(MARKER_SYMBOLS).tolist(), texts
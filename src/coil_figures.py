@@ -0,0 +1,98 @@
+import plotly.graph_objects as go
+from dash import html
+from coil_events import count_events, event_markers
+
+# Figures of the Coil-Voltages pages, built in one pass over the loaded logs.
+#
+# Every panel (graph) shows one RXE. The traces of all panels are collected
+# first and each figure is then created once with its layout, instead of adding
+# traces and updating the layout one log at a time. Series and event markers
+# are WebGL (Scattergl) traces, which stay responsive with far more points
+# than SVG traces.
+
+
+def series_trace(x, y, rxe, voltage):
+    return go.Scattergl(x=x, y=y, mode='lines', name=f"{voltage} ({rxe})")
+
+
+def events_trace(events, rxe, voltage):
+    # Events found with the voltage's threshold profile, drawn as markers
+    event_x, event_y, symbols, texts = event_markers(events)
+    return go.Scattergl(x=event_x, y=event_y, mode='markers', name=f"{voltage} events ({rxe})",
+                        marker={'symbol': symbols, 'size': 9}, hovertext=texts)
+
+
+def panel_figure(coil, rxe, data):
+    if not data:
+        return go.Figure()
+    return go.Figure(data=data, layout=go.Layout(
+        title=f"Voltage Graph: Coil = {coil}, RXE = {rxe}",
+        xaxis_title="Time", yaxis_title="Voltage", legend_title="Voltage Types"
+    ))
+
+
+def statistics_paragraphs(rxe, voltage, stats, events):
+    paragraphs = [
+        html.P(f"Statistics for RXE = {rxe}, Voltage = {voltage}:"),
+        html.P(f"Mean: {stats['mean']:.2f}"),
+        html.P(f"Min: {stats['min']:.2f}"),
+        html.P(f"Max: {stats['max']:.2f}")
+    ]
+    if events is not None:
+        counts = count_events(events)
+        paragraphs.append(html.P("Events: " + ", ".join(f"{n} {kind}" for kind, n in counts.items() if n)))
+    paragraphs.append(html.Hr(style={'border': '1px solid gray'}))
+    return paragraphs
+
+
+def build_figures(coil, panels, selected_rxe, selected_voltage, results):
+    # (figures, output content, traces) for the load_grid results of a selection;
+    # panels lists the RXE of every graph, traces maps 'rxe|voltage' to the
+    # [figure index, trace index] of its series for zooming and live updates
+    data = [[] for _ in panels]
+    traces = {}
+    statistics_text = []  # List to hold html elements for the output
+    error_messages = []  # List to hold error messages
+    for rxe in selected_rxe:
+        if rxe not in panels:
+            continue
+        fig_index = panels.index(rxe)
+        for voltage in selected_voltage:
+            try:
+                result = results[(rxe, voltage)]
+                if isinstance(result, Exception):  # Raised while loading
+                    raise result
+                if isinstance(result, str):  # If the file could not be found or read
+                    error_messages.append(html.P(f"Error: {result} for RXE = {rxe}, Voltage = {voltage}."))
+                    continue
+                (x, y), stats, events = result
+                if isinstance(events, str) or len(events) == 0:
+                    events = None
+
+                # Add the (downsampled) series; zooming fetches more detail
+                data[fig_index].append(series_trace(x, y, rxe, voltage))
+                traces[f"{rxe}|{voltage}"] = [fig_index, len(data[fig_index]) - 1]
+                if events is not None:
+                    data[fig_index].append(events_trace(events, rxe, voltage))
+                statistics_text.extend(statistics_paragraphs(rxe, voltage, stats, events))
+            except Exception as e:
+                error_messages.append(html.P(f"Unexpected error for RXE = {rxe}, Voltage = {voltage}: {e}."))
+
+    figures = [panel_figure(coil, rxe, panel_data) for rxe, panel_data in zip(panels, data)]
+    # Combine statistics and error messages
+    output_content = statistics_text + error_messages
+    if not output_content:  # If no content, show a default message
+        output_content = [html.P("No data available for the selected options.")]
+    return figures, output_content, traces
+
+
+def comparison_figure(curves, difference=False):
+    # Time-aligned series of the comparison page, overlaid in one graph
+    if not curves:
+        return go.Figure()
+    data = [go.Scattergl(x=x, y=y, mode='lines', name=label) for label, (x, y) in curves.items()]
+    return go.Figure(data=data, layout=go.Layout(
+        title="Difference to the reference" if difference else "Aligned series",
+        xaxis_title="Time", yaxis_title="Voltage difference" if difference else "Voltage",
+        legend_title="Series"
+    ))
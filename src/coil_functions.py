@@ -1,36 +1,422 @@
 
+import contextvars
+import io
 import os
+import threading
+import numpy as np
 import pandas as pd
 import tzlocal  # Library to get the local timezone
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from log_catalog import get_catalog
+from log_cache import log_cache
+from log_sidecar import SIDECARS_ENABLED, load_sidecar, write_sidecar
+from log_pyramid import get_pyramid
+from log_index import LOG_HEADER_LINES, get_index
+from log_tail import end_offset, read_appended
+from mqtt_ingest import ring_store
+from downsample import MAX_POINTS, downsample_window
+from coil_events import detect_events, empty_events, has_checks, profile_for
+from metrics import span
+from log_segments import compression, open_log, segments_in, first_timestamp, last_timestamp
 #
 
-def File(selected_coil,rxe,voltage):
+# Windows with more samples than this many times the point budget are drawn from the pyramid
+RAW_POINTS_FACTOR = 10
+# Threads per gunicorn worker for loading a selection; the total load concurrency
+# is (gunicorn workers x PROCOIL_LOAD_WORKERS), so lower it when adding workers
+LOAD_WORKERS = int(os.environ.get('PROCOIL_LOAD_WORKERS', '4'))
+# Parser used by File/File_2: 'fast' (C engine, compact frame) or 'python' (original reader)
+PARSER_ENGINE = os.environ.get('PROCOIL_PARSER', 'fast')
+
+
+def read_log(source, value_name='value', skiprows=LOG_HEADER_LINES, absolute=True, dtype=np.float32):
+    # Parse a coil log (path or buffer) into a compact frame with a 'datetime'
+    # column (int64 nanoseconds since the epoch) and a float32 value column
+    # (dtype=np.float64 keeps every digit, e.g. for exact statistics).
+    # Rows with too many fields are skipped, rows that do not parse are dropped.
+    # Compressed logs (.gz, .zst) are decompressed while they are parsed.
+    if isinstance(source, str) and compression(source):
+        with open_log(source) as f:
+            return read_log(f, value_name, skiprows, absolute, dtype)
+    try:
+        with span('parse'):
+            raw = pd.read_csv(source, skiprows=skiprows, sep='\t', header=None,
+                              names=['date', 'time', 'value'], dtype={'date': str, 'time': str},
+                              engine='c', on_bad_lines='skip')
+    except pd.errors.EmptyDataError:
+        raw = pd.DataFrame({'date': [], 'time': [], 'value': []}, dtype=str)
+    # One datetime parse with an exact format (fast path), no second pass for time_hm
+    with span('datetime'):
+        datetimes = pd.to_datetime(raw['date'].str.cat(raw['time'], sep=' '),
+                                   format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
+    timestamps = np.asarray(datetimes, dtype='datetime64[ns]').view('i8')
+    valid = timestamps != np.iinfo(np.int64).min  # NaT
+    values = pd.to_numeric(raw['value'], errors='coerce').to_numpy(dtype=dtype)
+    timestamps, values = timestamps[valid], values[valid]
+    # Take the absolute value of the value column (coil voltages)
+    return pd.DataFrame({
+        'datetime': timestamps.view('datetime64[ns]'),
+        value_name: np.abs(values) if absolute else values,
+    })
+
+
+def read_log_range(file_path, start=None, end=None, value_name='value'):
+    # Parse only the rows with start <= datetime <= end; the byte-offset index
+    # tells which part of the file holds them
+    start_ns = None if start is None else pd.Timestamp(start).value
+    end_ns = None if end is None else pd.Timestamp(end).value
+    low, high = get_index(file_path).span(start_ns, end_ns)
+    with open(file_path, 'rb') as f:
+        f.seek(low)
+        chunk = f.read(high - low)
+    chunk = chunk[:chunk.rfind(b'\n') + 1]  # Leave out a row still being written
+    df = read_log(io.BytesIO(chunk), value_name, skiprows=0)
+    timestamps = df['datetime'].to_numpy().view('i8')
+    keep = np.ones(len(df), dtype=bool)
+    if start_ns is not None:
+        keep &= timestamps >= start_ns
+    if end_ns is not None:
+        keep &= timestamps <= end_ns
+    return df[keep].reset_index(drop=True)
+
+
+def read_sidecar_range(file_path, start=None, end=None, value_name='value'):
+    # Rows with start <= datetime <= end sliced out of the memory-mapped sidecar,
+    # None if it is missing or older than the log
+    df = load_sidecar(file_path, value_name)
+    if df is None:
+        return None
+    return slice_range(df, start, end)
+
+
+def slice_range(df, start=None, end=None):
+    # Rows of a frame sorted by time with start <= datetime <= end
+    timestamps = df['datetime'].to_numpy()
+    low = 0 if start is None else np.searchsorted(timestamps, pd.Timestamp(start).to_datetime64(), 'left')
+    high = len(df) if end is None else np.searchsorted(timestamps, pd.Timestamp(end).to_datetime64(), 'right')
+    return df.iloc[low:high].reset_index(drop=True)
+
+
+def read_segment(file_path, value_name, cache_name, start=None, end=None, parse=None):
+    # Rows of one log file between start and end, the whole file if both are None.
+    # parse(path) is a reader that can only parse whole files (the original
+    # python parser): its frame is cached and sliced.
+    if parse is not None:
+        df = log_cache.get(file_path, cache_name, parse)
+        return df if start is None and end is None else slice_range(df, start, end)
+    load = lambda path: load_log(path, value_name)
+    if start is None and end is None:
+        # Repeat views of an unchanged file are served from the parsed-frame cache
+        return log_cache.get(file_path, cache_name, load)
+    # Only read the part of the file that holds the time range, from the
+    # sidecar when it is up to date
+    df = read_sidecar_range(file_path, start, end, value_name)
+    if df is not None:
+        return df
+    if compression(file_path):
+        # A compressed log can't be read from the middle: it is parsed once
+        # (leaving a sidecar behind for the next range) and sliced
+        return slice_range(log_cache.get(file_path, cache_name, load), start, end)
+    return read_log_range(file_path, start, end, value_name)
+
+
+def series_segments(selected_coil, rxe, voltage, start=None, end=None):
+    # Paths of the segments of a series (log_segments.py) holding the time
+    # range, in time order; without a range the latest log with the segments
+    # rotated away from it
+    catalog = get_catalog('.')
+    if start is None and end is None:
+        dates = catalog.dates(selected_coil, rxe, voltage)
+        paths = catalog.segments(selected_coil, rxe, voltage, dates[-1]) if dates else []
+        return segments_in(paths)
+    paths = catalog.segments(selected_coil, rxe, voltage)
+    to_ns = lambda bound: None if bound is None else pd.Timestamp(bound).value
+    return segments_in(paths, to_ns(start), to_ns(end)) or segments_in(paths)[-1:]
+
+
+def read_segments(file_paths, value_name, cache_name, start=None, end=None, parse=None):
+    # One frame of the segments between start and end, stitched in time order;
+    # an empty frame without segments (e.g. a new log with only its header)
+    if not file_paths:
+        return pd.DataFrame({'datetime': np.empty(0, dtype='datetime64[ns]'),
+                             value_name: np.empty(0, dtype=np.float32)})
+    frames = []
+    last = None
+    for file_path in file_paths:
+        df = read_segment(file_path, value_name, cache_name, start, end, parse)
+        if last is not None:
+            df = df[df['datetime'] > last]  # Rows a rotation left in both segments
+        if len(df) or not frames:
+            frames.append(df)
+            if len(df):
+                last = df['datetime'].iloc[-1]
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_log(file_path, value_name='value'):
+    # Memory-map the .npy sidecar while it is newer than the log, otherwise parse
+    # the text and leave a sidecar behind for the next load. Once written, the
+    # sidecar is mapped here as well, so no worker keeps a private copy.
+    df = load_sidecar(file_path, value_name)
+    if df is not None:
+        return df
+    source_mtime_ns = os.stat(file_path).st_mtime_ns
+    df = read_log(file_path, value_name)
+    if SIDECARS_ENABLED:
+        try:
+            write_sidecar(file_path, df, value_name, source_mtime_ns)
+            shared = load_sidecar(file_path, value_name)
+            if shared is not None:
+                return shared
+        except OSError as e:
+            print(f"Could not write sidecar for {file_path}: {e}")
+    return df
+
+
+def ring_frame(selected_coil, channel, parameter, value_name, start=None, end=None):
+    # Frame of an MQTT series between start and end, None if nothing was received
+    df = ring_store.frame(selected_coil, channel, parameter, value_name)
+    if df is None:
+        return None
+    if start is not None:
+        df = df[df['datetime'] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df['datetime'] <= pd.Timestamp(end)]
+    return df.reset_index(drop=True)
+
+
+def add_time_hm(df):
+    # Hours and minutes of each sample, only built for callers that need it
+    df['time_hm'] = df['datetime'].dt.strftime('%H:%M')
+    return df
+
+
+def File(selected_coil,rxe,voltage,time_hm=False,start=None,end=None):
     #
-    file_name = None
-        #print("Selections are " ,selected_coil ,  selected_rxe ,selected_voltage )
-    #print("Current working directory:", os.getcwd())
-    #print("Directory contents:", os.listdir('.'))
-    for file in os.listdir('.'):
-        #print(f"Checking file: {file}")
-        #if file.startswith(selected_coil) and selected_rxe in file and selected_voltage in file:
-        if selected_coil in file and rxe in file and voltage in file:
-            file_name = file
-            break
-    #print("the file is " , file_name)
+    # Look up the file in the indexed catalog of the data directory
+    file_path = get_catalog('.').lookup(selected_coil, rxe, voltage)
     
-    if file_name is None:
-        return "No matching file found"
-    print("Found file is = ", file_name)
+    if file_path is None:
+        # Series that only arrive over MQTT are read from their ring buffer
+        df = ring_frame(selected_coil, rxe, voltage, 'voltage', start, end)
+        if df is None:
+            return "No matching file found"
+        return add_time_hm(df) if time_hm else df
+    print("Found file is = ", os.path.basename(file_path))
     
     # Read the file and convert the data into a dataframe ignoring the header of 8 lines and using tab as separator
-    file_path = os.path.join('.', file_name)
-    
     print(" Compleate Path is = " , file_path)
+    # Rotated and compressed parts of the log are stitched back together
+    paths = series_segments(selected_coil, rxe, voltage, start, end)
+    if PARSER_ENGINE == 'python':
+        # The original reader parses whole files (it always adds time_hm)
+        return read_segments(paths, 'voltage', 'File:python', start, end, read_voltage_file)
+    df = read_segments(paths, 'voltage', 'File', start, end)
+    return add_time_hm(df) if time_hm else df
+
+
+def Pyramid(selected_coil, rxe, voltage):
+    # Minute/hour/day aggregates of the log, only parses it when they are out of date
+    file_path = get_catalog('.').lookup(selected_coil, rxe, voltage)
+    if file_path is None:
+        return "No matching file found"
+    load = lambda path: log_cache.get(path, 'File', lambda p: load_log(p, 'voltage'))
+    load_since = lambda path, start_ns: read_log_range(path, start_ns, None, 'voltage')
+    # Compressed logs don't grow and can't be read from the middle
+    return get_pyramid(file_path, load, 'voltage', None if compression(file_path) else load_since)
+
+
+def Window(selected_coil, selected_rxe, selected_voltage, hours):
+    # (start, end) covering the last hours of the selected logs, None if there is none
+    ends = []
+    for rxe in selected_rxe:
+        for voltage in selected_voltage:
+            file_path = get_catalog('.').lookup(selected_coil, rxe, voltage)
+            if file_path is not None:
+                ends.append(last_timestamp(file_path))
+    ends = [end for end in ends if end is not None]
+    if not hours or not ends:
+        return None
+    end = pd.Timestamp(max(ends))
+    return end - pd.Timedelta(hours=hours), end
+
+
+def Bounds(selected_coil, rxe, voltage):
+    # (first, last) timestamp in ns of the series over all its segments, None if there is no log
+    paths = segments_in(get_catalog('.').segments(selected_coil, rxe, voltage))
+    if not paths:
+        return None
+    first, last = first_timestamp(paths[0]), last_timestamp(paths[-1])
+    if first is None or last is None:
+        return None
+    return first, last
+
+
+def Tail(selected_coil, rxe, voltage, offset=None, max_points=MAX_POINTS, after=None):
+    # ((x, y), new offset) of the rows appended to the log after offset. Rows at
+    # or before the time after (the last point already plotted) are left out.
+    file_path = get_catalog('.').lookup(selected_coil, rxe, voltage)
+    if file_path is None:
+        return "No matching file found"
+    df, offset = read_appended(file_path, offset, lambda buffer: read_log(buffer, 'voltage', skiprows=0))
+    if df is not None and after is not None:
+        df = df[df['datetime'] > pd.Timestamp(after)]
+    if df is None or df.empty:
+        return None, offset
+    return downsample_window(df['datetime'], df['voltage'], None, max_points), offset
+
+
+def tail_offsets(selected_coil, selected_rxe, selected_voltage):
+    # Current end of every selected log, keyed 'rxe|voltage', to start following from
+    offsets = {}
+    for rxe in selected_rxe:
+        for voltage in selected_voltage:
+            file_path = get_catalog('.').lookup(selected_coil, rxe, voltage)
+            if file_path is not None:
+                offsets[f"{rxe}|{voltage}"] = end_offset(file_path)
+    return offsets
+
+
+def pyramid_covers(selected_coil, rxe, voltage, window=None):
+    # Whether the rows of the window (None = latest log) all lie in the newest
+    # log, the only one with a pyramid: not in a rotated segment, and not in a
+    # new log that has no rows yet
+    file_path = get_catalog('.').lookup(selected_coil, rxe, voltage)
+    return series_segments(selected_coil, rxe, voltage, *(window or (None, None))) == [file_path]
+
+
+def Trace(selected_coil, rxe, voltage, window=None, max_points=MAX_POINTS):
+    # (x, y) plot data for a time window (None = whole log): the downsampled raw
+    # samples for small windows, the finest fitting pyramid level for large ones
+    pyramid = Pyramid(selected_coil, rxe, voltage)
+    if isinstance(pyramid, str):
+        # No log file, there may still be an MQTT series
+        df = File(selected_coil, rxe, voltage)
+        if isinstance(df, str):
+            return df
+        return downsample_window(df['datetime'], df['voltage'], window, max_points)
+    # The pyramid only covers the newest log, not the segments rotated away from it
+    if pyramid.count(window) > RAW_POINTS_FACTOR * max_points and pyramid_covers(selected_coil, rxe, voltage, window):
+        return pyramid.trace(window, max_points)
+    if window:
+        df = File(selected_coil, rxe, voltage, start=window[0], end=window[1])
+    else:
+        df = File(selected_coil, rxe, voltage)
+    if isinstance(df, str):
+        return df
+    return downsample_window(df['datetime'], df['voltage'], window, max_points)
+
+
+def Statistics(selected_coil, rxe, voltage, window=None):
+    # Exact count/mean/min/max for a time window, answered from the pyramid
+    pyramid = Pyramid(selected_coil, rxe, voltage)
+    if isinstance(pyramid, str) or not pyramid_covers(selected_coil, rxe, voltage, window):
+        # No log file, there may still be an MQTT series; or a window the
+        # pyramid of the newest log does not cover
+        if window:
+            df = File(selected_coil, rxe, voltage, start=window[0], end=window[1])
+        else:
+            df = File(selected_coil, rxe, voltage)
+        if isinstance(df, str):
+            return df
+        return {'count': len(df), 'mean': df['voltage'].mean(), 'min': df['voltage'].min(), 'max': df['voltage'].max()}
+    # The partial minutes at the edges of the window are read from the log (sidecar or index)
+    file_path = get_catalog('.').lookup(selected_coil, rxe, voltage)
+    samples = lambda start, end: read_segment(file_path, 'voltage', 'File', start, end)['voltage'].to_numpy()
+    return pyramid.stats(window, samples)
+
+
+def Events(selected_coil, rxe, voltage, window=None, profiles=None):
+    # Event table of a time window (coil_events.detect_events) with the
+    # thresholds of the voltage's profile. The raw samples are only read
+    # when the profile has a check configured.
+    profile = profile_for(voltage, profiles)
+    if not has_checks(profile):
+        return empty_events()
+    if window:
+        df = File(selected_coil, rxe, voltage, start=window[0], end=window[1])
+    else:
+        df = File(selected_coil, rxe, voltage)
+    if isinstance(df, str):
+        return df
+    return detect_events(df['datetime'], df['voltage'], profile)
+
+
+_load_pool = None
+_load_pool_lock = threading.Lock()
+
+
+def get_load_pool():
+    # Created on first use, so every gunicorn worker gets its own threads after the fork
+    global _load_pool
+    with _load_pool_lock:
+        if _load_pool is None:
+            _load_pool = ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix='procoil-load')
+        return _load_pool
+
+
+def _reset_load_pool():
+    # A forked process (background job) has none of the parent's pool threads
+    global _load_pool, _load_pool_lock
+    _load_pool = None
+    _load_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_load_pool)
+
+
+def load_series(selected_coil, rxe, voltage, window=None, events=False, stats=True):
+    # ((x, y), stats) for one log, or the error message of Trace; with events
+    # ((x, y), stats, event table). stats=False leaves out the statistics (None).
+    trace = Trace(selected_coil, rxe, voltage, window)
+    if isinstance(trace, str):
+        return trace
+    statistics = Statistics(selected_coil, rxe, voltage, window) if stats else None
+    if events:
+        return trace, statistics, Events(selected_coil, rxe, voltage, window)
+    return trace, statistics
+
+
+def load_grid(selected_coil, selected_rxe, selected_voltage, window=None, progress=None, events=False, stats=True):
+    # Load every (rxe, voltage) of the selection concurrently. The result maps
+    # each pair to the load_series result, or to the exception it raised.
+    # progress(done, total) is called after every finished log.
+    keys = [(rxe, voltage) for rxe in selected_rxe for voltage in selected_voltage]
+    results = {}
+    if LOAD_WORKERS <= 1:
+        for rxe, voltage in keys:
+            try:
+                results[(rxe, voltage)] = load_series(selected_coil, rxe, voltage, window, events, stats)
+            except Exception as e:
+                results[(rxe, voltage)] = e
+            if progress:
+                progress(len(results), len(keys))
+        return results
+    pool = get_load_pool()
+    # Each load runs in a copy of the caller's context, so its timings count for the request
+    futures = {pool.submit(contextvars.copy_context().run, load_series, selected_coil, key[0], key[1], window, events,
+                           stats): key
+               for key in keys}
+    for future in as_completed(futures):
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            results[futures[future]] = e
+        if progress:
+            progress(len(results), len(keys))
+    return results
+
+
+def read_voltage_file(file_path):
     #"""
-    df = pd.read_csv(file_path, skiprows=9, sep='\t', engine='python', on_bad_lines='skip')
+    with span('parse'):
+        df = pd.read_csv(file_path, skiprows=9, sep='\t', engine='python', on_bad_lines='skip')
     df.columns = ['date', 'time', 'voltage']
-    df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'], format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
+    with span('datetime'):
+        df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'], format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
     # Drop rows with NaT values in datetime column (invalid parsing)
     df.dropna(subset=['datetime'], inplace=True)
     # Get the local timezone from the operating system
@@ -45,35 +431,41 @@ def File(selected_coil,rxe,voltage):
     ####
     return df
 ######################################################
-def File_2(selected_coil, channel, parameter):
-    file_name = None
-    # Search for the file matching the selected coil, channel, and parameter
-    for file in os.listdir('.'):
-        if selected_coil in file and channel in file and parameter in file:
-            file_name = file
-            break
-
-    if file_name is None:
-        return "No matching file found"
+def File_2(selected_coil, channel, parameter, time_hm=False, start=None, end=None):
+    # Look up the file matching the selected coil, channel, and parameter
+    file_path = get_catalog('.').lookup(selected_coil, channel, parameter)
 
-    print("Found file is =", file_name)
-    
-    # Construct the full file path
-    file_path = os.path.join('.', file_name)
+    if file_path is None:
+        df = ring_frame(selected_coil, channel, parameter, 'parameter', start, end)
+        if df is None:
+            return "No matching file found"
+        return add_time_hm(df) if time_hm else df
+
+    print("Found file is =", os.path.basename(file_path))
     print("Complete Path is =", file_path)
     
     # Read the file and process its data
     try:
-        df = pd.read_csv(file_path, skiprows=9, sep='\t', engine='python', on_bad_lines='skip', converters={'value': float})
-        df.columns = ['date', 'time', 'parameter']
-        df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'], format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
-        # Drop rows with NaT values in the datetime column (invalid parsing)
-        df.dropna(subset=['datetime'], inplace=True)
-        # Extract hours and minutes from the time column for simplified time representation
-        df['time_hm'] = pd.to_datetime(df['time'], format='%H:%M:%S.%f').dt.strftime('%H:%M')
-        # Take the absolute value of the parameter column
-        df['parameter'] = df['parameter'].abs()
-        return df
+        # Rotated and compressed parts of the log are stitched back together
+        paths = series_segments(selected_coil, channel, parameter, start, end)
+        if PARSER_ENGINE == 'python':
+            # The original reader parses whole files (it always adds time_hm)
+            return read_segments(paths, 'parameter', 'File_2:python', start, end, read_parameter_file)
+        df = read_segments(paths, 'parameter', 'File_2', start, end)
+        return add_time_hm(df) if time_hm else df
     except Exception as e:
         print(f"Error reading or processing the file: {e}")
         return f"Error processing the file: {e}"
+
+
+def read_parameter_file(file_path):
+    df = pd.read_csv(file_path, skiprows=9, sep='\t', engine='python', on_bad_lines='skip', converters={'value': float})
+    df.columns = ['date', 'time', 'parameter']
+    df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'], format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
+    # Drop rows with NaT values in the datetime column (invalid parsing)
+    df.dropna(subset=['datetime'], inplace=True)
+    # Extract hours and minutes from the time column for simplified time representation
+    df['time_hm'] = pd.to_datetime(df['time'], format='%H:%M:%S.%f').dt.strftime('%H:%M')
+    # Take the absolute value of the parameter column
+    df['parameter'] = df['parameter'].abs()
+    return df
@@ -0,0 +1,262 @@
+import numpy as np
+import pandas as pd
+from dash import dcc, html, Input, Output, State, callback, ctx, no_update, Patch
+from dash.exceptions import PreventUpdate
+from coil_functions import load_grid, Window, Tail, tail_offsets
+from coil_figures import build_figures, panel_figure
+from downsample import relayout_window
+from log_tail import LIVE_INTERVAL_MS, LIVE_MAX_POINTS
+from background_jobs import background_manager
+from metrics import span
+
+# Layout and callbacks of the Coil-Voltages pages, one page per coil variant.
+#
+# A variant is plain data: the coils that can be selected, the RXE shown (one
+# graph per RXE, in this order) and the voltages. A new coil variant only needs
+# an entry here and a page file that calls layout() and register_callbacks().
+# The component ids of a variant start with its 'id'.
+
+VARIANTS = {
+    '16': {
+        'id': 'cv16',
+        'title': "Welcome to Coil Analyzer",
+        'coils': [
+            #('BASE', 'BASE'),
+            ('DCP', 'DCP'),
+            ('KNEE16', 'KNEE_16'),
+            ('ACI', 'ACI'),
+            ('SHOULDER16', 'SHOULDER_16'),
+            ('ANTERIOR', 'ANTERIOR'),
+        ],
+        'rxe': ['MSEQ0', 'MSEQ1', 'MSEQ2', 'MSEQ3'],
+        'voltages': ['VDH', 'VDL', 'VLNA', 'VPIN'],
+    },
+    '8': {
+        'id': 'cv8',
+        'title': "Welcome to Coil Analyzer - ",
+        'coils': [
+            ('BASE', 'BASE'),
+            ('HEAD_NECK', 'HEAD_NECK'),
+            #('HEAD', 'HEAD_E'),
+            ('KNEE8', 'KNEE8'),
+            ('POSTERIOR', 'POSTERIOR'),
+            ('SHOULDER8', 'SHOULDER8'),
+            #('ANTERIOR', 'ANTERIOR'),
+        ],
+        'rxe': ['MSEQ0', 'MSEQ1'],  # Two RXE at most
+        'voltages': ['VDH', 'VDL', 'VLNA', 'VPIN'],
+    },
+}
+RANGE_OPTIONS = [
+    {'label': 'All data', 'value': 0},
+    {'label': 'Last hour', 'value': 1},
+    {'label': 'Last 6 hours', 'value': 6},
+    {'label': 'Last 24 hours', 'value': 24},
+    {'label': 'Last 7 days', 'value': 168}
+]
+
+
+def component_id(variant, name):
+    return f"{variant['id']}-{name}"
+
+
+def graph_ids(variant):
+    return [component_id(variant, f"graph-{rxe}") for rxe in variant['rxe']]
+
+
+def layout(variant):
+    return html.Div([
+        html.P(variant['title']),
+        dcc.Dropdown(
+            id=component_id(variant, 'coil-dropdown'),
+            options=[{'label': label, 'value': value} for label, value in variant['coils']],
+            placeholder="Select the coil",
+            style={'width': '50%', 'margin': '0 auto'}
+        ),
+        html.Hr(style={'border': '3px solid green', 'margin': '10px auto', 'width': '60%'}),
+        dcc.Dropdown(
+            id=component_id(variant, 'rxe-dropdown'),
+            options=[{'label': rxe, 'value': rxe} for rxe in variant['rxe']],
+            value=variant['rxe'],  # All RXE by default
+            multi=True,
+            placeholder="Select the RXE option",
+            style={'width': '50%', 'margin': '0 auto', 'color': 'blue'}
+        ),
+        dcc.Dropdown(
+            id=component_id(variant, 'voltage-dropdown'),
+            options=[{'label': voltage, 'value': voltage} for voltage in variant['voltages']],
+            value=variant['voltages'],  # All voltages by default
+            multi=True,
+            placeholder="Select the voltage",
+            style={'width': '50%', 'margin': '0 auto', 'color': 'blue'}
+        ),
+        dcc.Dropdown(
+            id=component_id(variant, 'range-dropdown'),
+            options=RANGE_OPTIONS,
+            value=0,  # Whole logs by default
+            clearable=False,
+            placeholder="Select the time range",
+            style={'width': '50%', 'margin': '0 auto', 'color': 'blue'}
+        ),
+        html.Button('Graph', id=component_id(variant, 'graph-button'), n_clicks=0, style={'marginTop': '20px'}),
+        dcc.Checklist(
+            id=component_id(variant, 'live-checklist'),
+            options=[{'label': ' Live update', 'value': 'live'}],
+            value=[],
+            inline=True,
+            style={'marginTop': '10px'}
+        ),
+        html.Hr(style={'border': '3px solid blue', 'margin': '10px auto', 'width': '60%'}),
+        # One graph per RXE
+        *[dcc.Graph(id=graph_id) for graph_id in graph_ids(variant)],
+        html.Div("Click the 'Graph' button to start.", id=component_id(variant, 'output-div'),
+                 style={'marginTop': '20px'}),
+        # Id of the variant, part of the key of its background loads
+        dcc.Store(id=component_id(variant, 'variant'), data=variant['id']),
+        # Selection shown in the graphs, used when zooming
+        dcc.Store(id=component_id(variant, 'selection-store')),
+        # Bytes of each log already shown, used in live mode
+        dcc.Store(id=component_id(variant, 'live-offsets')),
+        dcc.Interval(id=component_id(variant, 'live-interval'), interval=LIVE_INTERVAL_MS, disabled=True)
+    ], style={'textAlign': 'center'})
+
+
+def register_callbacks(variant):
+    # Returns (update_output, update_zoom, toggle_live, update_live) of the variant
+    graphs = graph_ids(variant)
+    panels = variant['rxe']
+
+    @callback(
+        [Output(graph_id, 'figure') for graph_id in graphs] +
+        [Output(component_id(variant, 'output-div'), 'children'),
+         Output(component_id(variant, 'selection-store'), 'data'),
+         Output(component_id(variant, 'live-offsets'), 'data')],
+        [Input(component_id(variant, 'graph-button'), 'n_clicks')],
+        [State(component_id(variant, 'coil-dropdown'), 'value'),
+         State(component_id(variant, 'rxe-dropdown'), 'value'),
+         State(component_id(variant, 'voltage-dropdown'), 'value'),
+         State(component_id(variant, 'range-dropdown'), 'value'),
+         State(component_id(variant, 'variant'), 'data')],
+        # Loads run in a separate process so they don't hold a gunicorn worker; clicking
+        # Graph again cancels the running load, identical selections share one load.
+        # The callback function is the same for every variant, so the variant id
+        # is passed in to keep their loads apart.
+        background=True,
+        manager=background_manager,
+        progress=[Output(component_id(variant, 'output-div'), 'children')],
+        cache_args_to_ignore=[0],  # n_clicks
+        prevent_initial_call=True
+    )
+    def update_output(set_progress, n_clicks, selected_coil, selected_rxe, selected_voltage, selected_hours,
+                      variant_id):
+        empty = [panel_figure(None, None, []) for _ in panels]
+        if not selected_coil or not selected_rxe or not selected_voltage:
+            return empty + ["Please make all selections.", None, None]
+        selected_rxe = [rxe for rxe in selected_rxe if rxe in panels]
+
+        # Load all selected files at once, then generate figures and handle errors.
+        # A time range only reads the matching part of each log.
+        window = Window(selected_coil, selected_rxe, selected_voltage, selected_hours)
+        # Live mode follows the logs from their end before the load; rows the
+        # load already drew are skipped by their time (see 'last' below)
+        offsets = tail_offsets(selected_coil, selected_rxe, selected_voltage)
+        def report(done, total):  # Shown in the statistics area until the figures arrive
+            set_progress(html.P(f"Loaded {done} of {total} logs..."))
+        results = load_grid(selected_coil, selected_rxe, selected_voltage, window, progress=report, events=True)
+        with span('figure'):  # Building the figures, timed for /metrics
+            figures, output_content, traces = build_figures(selected_coil, panels, selected_rxe,
+                                                            selected_voltage, results)
+
+        # Time of the last point drawn of every trace
+        last = {}
+        for key in traces:
+            x = np.asarray(results[tuple(key.split('|'))][0][0])
+            if len(x):
+                last[key] = str(pd.Timestamp(x.max()))
+        selection = {'coil': selected_coil, 'rxe': selected_rxe, 'voltage': selected_voltage,
+                     'window': [str(bound) for bound in window] if window else None, 'traces': traces,
+                     'last': last}
+        return figures + [html.Div(output_content), selection, offsets]
+
+    # Zoom callback: re-aggregate the visible time window of a graph at full point budget
+    @callback(
+        [Output(graph_id, 'figure', allow_duplicate=True) for graph_id in graphs],
+        [Input(graph_id, 'relayoutData') for graph_id in graphs],
+        [State(component_id(variant, 'selection-store'), 'data')],
+        prevent_initial_call=True
+    )
+    def update_zoom(*args):
+        relayouts, selection = args[:-1], args[-1]
+        if not selection or ctx.triggered_id not in graphs:
+            raise PreventUpdate
+
+        fig_index = graphs.index(ctx.triggered_id)
+        window = relayout_window(relayouts[fig_index])
+        if window is False:  # Not a change of the time axis
+            raise PreventUpdate
+        if window is None and selection.get('window'):  # Reset to the selected time range
+            window = tuple(pd.Timestamp(bound) for bound in selection['window'])
+        rxe = panels[fig_index]  # Graph index matches the RXE
+        if rxe not in selection['rxe']:
+            raise PreventUpdate
+
+        # Only replace the x/y data of the traces, the layout keeps the user's zoom
+        figure = Patch()
+        results = load_grid(selection['coil'], [rxe], selection['voltage'], window, stats=False)
+        for voltage in selection['voltage']:
+            result = results[(rxe, voltage)]
+            key = f"{rxe}|{voltage}"
+            if isinstance(result, (str, Exception)) or key not in selection['traces']:
+                continue
+            (x, y), _ = result
+            trace_index = selection['traces'][key][1]
+            figure['data'][trace_index]['x'] = x
+            figure['data'][trace_index]['y'] = y
+        outputs = [no_update] * len(graphs)
+        outputs[fig_index] = figure
+        return outputs
+
+    # Live mode: poll the logs while the checkbox is set
+    @callback(
+        Output(component_id(variant, 'live-interval'), 'disabled'),
+        Input(component_id(variant, 'live-checklist'), 'value')
+    )
+    def toggle_live(live):
+        return 'live' not in (live or [])
+
+    # Live callback: parse only the rows appended since the last tick and extend the traces with them
+    @callback(
+        [Output(graph_id, 'extendData') for graph_id in graphs] +
+        [Output(component_id(variant, 'live-offsets'), 'data', allow_duplicate=True)],
+        [Input(component_id(variant, 'live-interval'), 'n_intervals')],
+        [State(component_id(variant, 'selection-store'), 'data'),
+         State(component_id(variant, 'live-offsets'), 'data')],
+        prevent_initial_call=True
+    )
+    def update_live(n_intervals, selection, offsets):
+        if not selection or not offsets:
+            raise PreventUpdate
+
+        extensions = [{'x': [], 'y': [], 'indices': []} for _ in graphs]
+        for key, (fig_index, trace_index) in selection['traces'].items():
+            rxe, voltage = key.split('|')
+            tail = Tail(selection['coil'], rxe, voltage, offsets.get(key), after=selection.get('last', {}).get(key))
+            if isinstance(tail, str):
+                continue
+            points, offsets[key] = tail
+            if points is None:
+                continue
+            extensions[fig_index]['x'].append(points[0])
+            extensions[fig_index]['y'].append(points[1])
+            extensions[fig_index]['indices'].append(trace_index)
+
+        if not any(extension['indices'] for extension in extensions):
+            raise PreventUpdate
+        outputs = [
+            [{'x': extension['x'], 'y': extension['y']}, extension['indices'], LIVE_MAX_POINTS]
+            if extension['indices'] else no_update
+            for extension in extensions
+        ]
+        return outputs + [offsets]
+
+    return update_output, update_zoom, toggle_live, update_live
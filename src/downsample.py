@@ -0,0 +1,62 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Reduce a series to a fixed number of points before it is sent to the browser.
+#
+# The series is cut into equal-count buckets and the minimum and maximum sample
+# of every bucket are kept (in time order), so short spikes survive even when a
+# week of samples is drawn with a few thousand points.
+
+# Point budget per trace, for the full view and for every zoomed window
+MAX_POINTS = int(os.environ.get('PROCOIL_MAX_POINTS', '4000'))
+
+
+def minmax_downsample(x, y, max_points=MAX_POINTS):
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n <= max_points or max_points < 4:
+        return x, y
+    # Two points (min and max) per bucket
+    size = -(-n // (max_points // 2))
+    buckets = -(-n // size)
+    padding = buckets * size - n
+    values = y.astype(np.float64)
+    missing = np.isnan(values)
+    lows = np.concatenate([np.where(missing, np.inf, values), np.full(padding, np.inf)]).reshape(buckets, size)
+    highs = np.concatenate([np.where(missing, -np.inf, values), np.full(padding, -np.inf)]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    index = np.concatenate([offsets + lows.argmin(axis=1), offsets + highs.argmax(axis=1), [0, n - 1]])
+    index = np.unique(np.minimum(index, n - 1))
+    return x[index], y[index]
+
+
+def relayout_window(relayout_data):
+    # Visible x range from a graph's relayoutData:
+    #   (start, end) after a zoom or pan, None after a reset, False if x did not change
+    if not relayout_data:
+        return False
+    if relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        start, end = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        start, end = relayout_data['xaxis.range']
+    else:
+        return False
+    return pd.Timestamp(start), pd.Timestamp(end)
+
+
+def downsample_window(datetimes, values, window=None, max_points=MAX_POINTS):
+    # Downsample only the samples inside window (plus one on each side so the
+    # line runs to the edge of the plot); the whole series if window is None.
+    # Logs are written in time order, so the window is found by binary search.
+    x = np.asarray(datetimes)
+    y = np.asarray(values)
+    if window:
+        start, end = (np.datetime64(bound.to_datetime64(), 'ns') for bound in window)
+        first = max(np.searchsorted(x, start, side='left') - 1, 0)
+        last = min(np.searchsorted(x, end, side='right') + 1, len(x))
+        x, y = x[first:last], y[first:last]
+    return minmax_downsample(x, y, max_points)
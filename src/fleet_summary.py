@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from log_catalog import LogCatalog
+from log_sidecar import SIDECAR_DIR, load_sidecar
+from coil_events import KINDS, EVENT_COLUMNS, count_events, detect_events, load_profiles, profile_for
+
+# Summary statistics of every coil log under a directory tree.
+#
+# The logs are parsed in a pool of processes (a sidecar is mapped instead when
+# it is fresh) and reduced to one row per log: count, mean, min, max,
+# percentiles, gaps in the sampling and, with --limits, the samples outside
+# the allowed band of the parameter. A rotated log (log_segments.py) is one
+# row over all its segments: path, mtime_ns and size are those of the newest
+# segment, segments and bytes count all of them. The rows are written to one
+# CSV table, .procoil/fleet_summary.csv in the scanned directory by default,
+# which the Fleet-Summary page shows without parsing any log. With --profiles the events
+# of coil_events.py are detected as well: their counts per kind are added to
+# the table and every event is written to fleet_events.csv next to it.
+#
+#   python fleet_summary.py <directory> [--recursive] [--workers N] [--gap SECONDS]
+#                           [--limits limits.json] [--profiles event_profiles.json]
+#                           [--output table.csv]
+#
+# limits.json maps parameters to [low, high], e.g. {"VDH": [4.5, 5.5]}; a bound
+# may be null.
+
+SUMMARY_NAME = 'fleet_summary.csv'
+EVENTS_NAME = 'fleet_events.csv'
+PERCENTILES = [1, 5, 50, 95, 99]
+# Pauses between two samples longer than this count as a gap
+DEFAULT_GAP_SECONDS = 60
+COLUMNS = (['coil', 'channel', 'parameter', 'date', 'path', 'mtime_ns', 'size', 'segments', 'bytes',
+            'count', 'mean', 'std', 'min', 'max']
+           + [f"p{q}" for q in PERCENTILES]
+           + ['first', 'last', 'gaps', 'gap_seconds', 'out_of_range'] + KINDS + ['error'])
+
+
+def summary_path(directory):
+    return os.path.join(directory, SIDECAR_DIR, SUMMARY_NAME)
+
+
+def find_logs(directory, recursive=False):
+    # ((coil, channel, parameter, date), segment paths oldest first) of the coil
+    # logs under directory, hidden folders are skipped
+    logs = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if recursive and not d.startswith('.'))
+        catalog = LogCatalog(root)
+        logs.extend((key, catalog.segments(*key)) for key in catalog.series())
+    return logs
+
+
+def summarize(timestamps, values, gap_seconds=DEFAULT_GAP_SECONDS, limits=None):
+    # Statistics of one series; timestamps in ns, sorted as in the log
+    timestamps = np.asarray(timestamps).view('i8')
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    row = {'count': int(valid.sum())}
+    if row['count']:
+        present = values[valid]
+        row.update({'mean': present.mean(), 'std': present.std(), 'min': present.min(), 'max': present.max()})
+        row.update(zip((f"p{q}" for q in PERCENTILES), np.percentile(present, PERCENTILES)))
+    if len(timestamps):
+        row['first'] = pd.Timestamp(timestamps[0])
+        row['last'] = pd.Timestamp(timestamps[-1])
+        steps = np.diff(timestamps)
+        long_steps = steps[steps > gap_seconds * 10**9]
+        row['gaps'] = len(long_steps)
+        row['gap_seconds'] = long_steps.sum() / 1e9
+    if limits is not None:
+        low, high = limits
+        outside = np.zeros(len(values), dtype=bool)
+        if low is not None:
+            outside |= values < low
+        if high is not None:
+            outside |= values > high
+        row['out_of_range'] = int(outside.sum())
+    return row
+
+
+def read_segments(paths):
+    # (timestamps, values) of the segments of a log stitched in order, without
+    # the rows a rotation left in two segments
+    from coil_functions import read_log
+
+    timestamps, values = [], []
+    last = None
+    for path in paths:
+        df = load_sidecar(path)
+        if df is None:
+            df = read_log(path)
+        segment_timestamps, segment_values = df['datetime'].to_numpy().view('i8'), df['value'].to_numpy()
+        if last is not None:
+            keep = segment_timestamps > last
+            segment_timestamps, segment_values = segment_timestamps[keep], segment_values[keep]
+        if len(segment_timestamps):
+            last = segment_timestamps[-1]
+        timestamps.append(segment_timestamps)
+        values.append(segment_values)
+    return np.concatenate(timestamps).view('datetime64[ns]'), np.concatenate(values)
+
+
+def summarize_log(key, paths, gap_seconds=DEFAULT_GAP_SECONDS, limits=None, profiles=None):
+    # (table row, event table or None) for the log with the segments at paths;
+    # runs in the worker processes
+    coil, channel, parameter, date = key
+    stat = os.stat(paths[-1])
+    row = {'coil': coil, 'channel': channel, 'parameter': parameter, 'date': date,
+           'path': os.path.abspath(paths[-1]), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+           'segments': len(paths), 'bytes': sum(os.path.getsize(path) for path in paths)}
+    events = None
+    try:
+        timestamps, values = read_segments(paths)
+        row.update(summarize(timestamps, values, gap_seconds, (limits or {}).get(parameter)))
+        if profiles is not None:
+            events = detect_events(timestamps, values, profile_for(parameter, profiles))
+            row.update(count_events(events))
+            for column, value in (('date', date), ('parameter', parameter), ('channel', channel), ('coil', coil)):
+                events.insert(0, column, value)
+    except Exception as e:
+        row['error'] = str(e)
+    return row, events
+
+
+def scan(directory, recursive=False, workers=None, gap_seconds=DEFAULT_GAP_SECONDS, limits=None,
+         profiles=None):
+    # (summary table, event table or None) of all logs under directory,
+    # printing the throughput as it goes
+    logs = find_logs(directory, recursive)
+    total_bytes = sum(os.path.getsize(path) for key, paths in logs for path in paths)
+    print(f"Found {len(logs)} logs in {sum(len(paths) for key, paths in logs)} files ({total_bytes / 1e6:.1f} MB)")
+    rows = []
+    events = []
+    done_bytes = 0
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(summarize_log, key, paths, gap_seconds, limits, profiles): key for key, paths in logs}
+        for future in as_completed(futures):
+            row, log_events = future.result()
+            rows.append(row)
+            if log_events is not None:
+                events.append(log_events)
+            done_bytes += row['bytes']
+            elapsed = max(time.time() - started, 1e-9)
+            if row.get('error'):
+                print(f"Error reading {row['path']}: {row['error']}")
+            if len(rows) % 50 == 0 or len(rows) == len(logs):
+                print(f"{len(rows)}/{len(logs)} logs, {len(rows) / elapsed:.1f} files/s, "
+                      f"{done_bytes / 1e6 / elapsed:.1f} MB/s")
+    order = ['coil', 'channel', 'parameter', 'date']
+    table = pd.DataFrame(rows, columns=COLUMNS).sort_values(order).reset_index(drop=True)
+    if profiles is None:
+        return table, None
+    if not events:
+        return table, pd.DataFrame(columns=order + EVENT_COLUMNS)
+    return table, pd.concat(events, ignore_index=True).sort_values(order + ['start']).reset_index(drop=True)
+
+
+def load_summary(directory='.', path=None):
+    # The table written by a scan of directory, or None if there is none. The
+    # 'stale' column marks logs that changed or disappeared since the scan.
+    path = path or summary_path(directory)
+    try:
+        table = pd.read_csv(path, parse_dates=['first', 'last'])
+    except (OSError, pd.errors.EmptyDataError):
+        return None
+    table = table.reindex(columns=COLUMNS)  # Tables of older scans lack the newer columns
+    stale = []
+    for log_path, mtime_ns, size in zip(table['path'], table['mtime_ns'], table['size']):
+        try:
+            stat = os.stat(log_path)
+            stale.append((stat.st_mtime_ns, stat.st_size) != (mtime_ns, size))
+        except OSError:
+            stale.append(True)
+    table['stale'] = stale
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize every coil log under a directory.")
+    parser.add_argument('directory', nargs='?', default='.', help="Directory with the coil logs")
+    parser.add_argument('--recursive', action='store_true', help="Also scan subdirectories")
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument('--gap', type=float, default=DEFAULT_GAP_SECONDS,
+                        help="Seconds without samples that count as a gap")
+    parser.add_argument('--limits', help="JSON file with the [low, high] band of each parameter")
+    parser.add_argument('--profiles', help="JSON file with the event threshold profiles (see coil_events.py)")
+    parser.add_argument('--output', help=f"Table to write (default: <directory>/{SIDECAR_DIR}/{SUMMARY_NAME})")
+    args = parser.parse_args(argv)
+
+    limits = None
+    if args.limits:
+        with open(args.limits) as f:
+            limits = json.load(f)
+    profiles = load_profiles(args.profiles) if args.profiles else None
+    started = time.time()
+    table, events = scan(args.directory, args.recursive, args.workers, args.gap, limits, profiles)
+    output = args.output or summary_path(args.directory)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    table.to_csv(output, index=False)
+    if events is not None:
+        events_output = os.path.join(os.path.dirname(output), EVENTS_NAME)
+        events.to_csv(events_output, index=False)
+        print(f"{len(events)} events written to {events_output}")
+    failed = int(table['error'].notna().sum())
+    print(f"{len(table)} logs summarized, {failed} failed in {time.time() - started:.1f} s, written to {output}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
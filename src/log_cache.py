@@ -0,0 +1,103 @@
+import os
+import threading
+from collections import OrderedDict
+
+# In-process LRU cache of parsed log DataFrames.
+#
+# Entries are keyed by (path, reader name) and remember the mtime and size of the
+# file they were parsed from, so a log that was rewritten or appended to is parsed
+# again. The cache is bounded by the memory of the cached frames, not by count.
+# Frames mapped from the shared sidecar store (log_sidecar.py) are not held
+# here: every worker maps them again for the price of a few stat calls, and
+# the store keeps them within its own budget.
+
+DEFAULT_CACHE_MB = int(os.environ.get('PROCOIL_CACHE_MB', '256'))
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def frame_size(df):
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        return 0
+
+
+class LogCache:
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (path, reader) -> (signature, df, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0     # Misses answered by the shared sidecar store
+        self.evictions = 0
+
+    def get(self, path, reader, load):
+        # Return the parsed frame for path, calling load(path) on a miss
+        key = (os.path.abspath(path), reader)
+        signature = file_signature(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1].copy(deep=False)
+            self.misses += 1
+
+        df = load(path)
+        if isinstance(df, str):  # Error messages are not cached
+            return df
+        if df.attrs.get('shared'):  # Mapped from the shared sidecar store, nothing to hold here
+            self.shared += 1
+            return df
+        size = frame_size(df)
+        with self._lock:
+            self._remove(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (signature, df, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    oldest = next(iter(self._entries))
+                    self._remove(oldest)
+                    self.evictions += 1
+        return df.copy(deep=False)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def reset_after_fork(self):
+        # A forked process (background job) has none of the worker's other
+        # threads: their lock is replaced and the size recounted, in case one
+        # of them was in the middle of an insert
+        self._lock = threading.Lock()
+        self.bytes = sum(entry[2] for entry in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'evictions': self.evictions,
+            }
+
+
+# Shared cache used by File/File_2
+log_cache = LogCache()
+os.register_at_fork(after_in_child=log_cache.reset_after_fork)
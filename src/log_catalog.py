@@ -0,0 +1,213 @@
+import os
+import re
+import threading
+from metrics import span
+from log_segments import COMPRESSIONS
+
+# Index of the coil log files found in a data directory.
+#
+# Log names are parsed once into (coil, channel, parameter, date), e.g.
+#   KNEE_16_MSEQ0_VDH_2024-11-05.txt -> ('KNEE_16', 'MSEQ0', 'VDH', '2024-11-05')
+# The parameter is the token right after the channel token, and the coil is
+# everything before the channel. Logs named with the parameter last, e.g.
+#   KNEE8_VDH_MSEQ0.txt -> ('KNEE8', 'MSEQ0', 'VDH', '')
+# take the parameter from right before the channel instead. Lookups compare
+# whole names instead of substrings, so 'KNEE8' never picks up a 'KNEE8X' log
+# and 'VDL' never picks up another parameter. Log files whose name does not
+# parse are printed once, as they can't be selected.
+#
+# Rotated and compressed logs (log_segments.py) belong to the series of the
+# log they came from, e.g. for KNEE_16_MSEQ0_VDH_2024-11-05.txt:
+#   ...txt.gz, ...txt.zst       compressed
+#   ...txt.1, ...txt.2.gz       rotated (higher numbers are older)
+#   ...txt-20241106.gz          rotated with the date extension of logrotate
+
+# Channel tokens, e.g. MSEQ0, RXE1, CH12
+CHANNEL_PATTERN = re.compile(r'^(MSEQ|RXE|CH)\d+$', re.IGNORECASE)
+# Dates in the file name: 2024-11-05, 2024_11_05 or 20241105
+DATE_PATTERN = re.compile(r'(?<!\d)(\d{4})[-_]?(\d{2})[-_]?(\d{2})(?!\d)')
+TOKEN_SPLIT = re.compile(r'[_\-\s]+')
+LOG_EXTENSIONS = ('.txt', '.log', '.csv', '.tsv', '')
+# Rotation suffix after the extension: .1, .2 ... or -YYYYMMDD
+ROTATION_PATTERN = re.compile(r'^(.+\.(?:txt|log|csv|tsv))(?:\.(\d+)|-(\d{8}))$', re.IGNORECASE)
+LIVE = (1, 0)
+
+
+def split_segment_name(file_name):
+    # (log name, rotation, compressed): the name of the log the segment was
+    # rotated from, a rank that orders the segments of one log (older first,
+    # LIVE for the log itself) and whether the segment is compressed
+    name, ext = os.path.splitext(file_name)
+    compressed = ext.lower() in COMPRESSIONS
+    if not compressed:
+        name = file_name
+    match = ROTATION_PATTERN.match(name)
+    if match is None:
+        return name, LIVE, compressed
+    number, stamp = match.group(2), match.group(3)
+    return match.group(1), (0, -int(number)) if number else (0, int(stamp)), compressed
+
+
+def parse_log_name(file_name):
+    # Returns (coil, channel, parameter, date) or None if the name is not a coil log
+    if file_name.startswith('.'):
+        return None
+    stem, ext = os.path.splitext(split_segment_name(file_name)[0])
+    if ext.lower() not in LOG_EXTENSIONS or file_name.startswith('.'):
+        return None
+    date = ''
+    match = DATE_PATTERN.search(stem)
+    if match:
+        date = '-'.join(match.groups())
+        stem = stem[:match.start()] + '_' + stem[match.end():]
+    tokens = [token for token in TOKEN_SPLIT.split(stem) if token]
+    for i, token in enumerate(tokens):
+        if CHANNEL_PATTERN.match(token):
+            if i > 0 and i + 1 < len(tokens):
+                return '_'.join(tokens[:i]), token, tokens[i + 1], date
+            if i > 1:  # <coil>_<parameter>_<channel>
+                return '_'.join(tokens[:i - 1]), token, tokens[i - 1], date
+            return None
+    return None
+
+
+def looks_like_log(file_name):
+    # A data file, named like a log or not
+    stem, ext = os.path.splitext(split_segment_name(file_name)[0])
+    return not file_name.startswith('.') and ext.lower() in LOG_EXTENSIONS and ext != ''
+
+
+class LogCatalog:
+    # Keeps the parsed file names of one directory and refreshes them when the
+    # directory mtime changes (files added, removed or renamed).
+
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._names = {}    # file name -> parsed key (or None if not a coil log)
+        self._entries = {}  # (coil, channel, parameter) -> {date: {rotation: file name}}
+
+    def refresh(self, force=False):
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            mtime = None
+        if not force and mtime == self._dir_mtime:
+            return
+        with self._lock:
+            if not force and mtime == self._dir_mtime:
+                return
+            with span('scan'):
+                try:
+                    current = set(os.listdir(self.directory))
+                except OSError:
+                    current = set()
+                # Only parse names that were not seen before
+                names = {name: self._names[name] if name in self._names else parse_log_name(name)
+                         for name in current}
+                for name in current - self._names.keys():
+                    if names[name] is None and looks_like_log(name):
+                        print(f"Not a coil log name, skipped: {name}")
+                entries = {}
+                for name, key in names.items():
+                    if key is None:
+                        continue
+                    coil, channel, parameter, date = key
+                    segments = entries.setdefault((coil, channel, parameter), {}).setdefault(date, {})
+                    rotation = split_segment_name(name)[1]
+                    if rotation not in segments or self._prefer(name, segments[rotation]):
+                        segments[rotation] = name
+            self._names = names
+            self._entries = entries
+            self._dir_mtime = mtime
+
+    def _prefer(self, name, other):
+        # Which of two files of the same date and rotation to keep
+        log_name, _, compressed = split_segment_name(name)
+        other_log_name, _, other_compressed = split_segment_name(other)
+        if log_name == other_log_name and compressed != other_compressed:
+            # Caught while the log is compressed: the plain file is complete
+            return not compressed
+        # Keep the newest file if the same date was logged twice
+        return self._mtime(name) > self._mtime(other)
+
+    def _mtime(self, name):
+        try:
+            return os.stat(os.path.join(self.directory, name)).st_mtime_ns
+        except OSError:
+            return 0
+
+    def lookup(self, coil, channel, parameter, date=None):
+        # Path of the log for the selection; the latest date if no date is given
+        self.refresh()
+        dates = self._entries.get((coil, channel, parameter))
+        if not dates:
+            return None
+        if date is None:
+            date = max(dates)
+        segments = dates.get(date)
+        if not segments:
+            return None
+        # The live log, or the newest segment once it was rotated away
+        return os.path.join(self.directory, segments[max(segments)])
+
+    def segments(self, coil, channel, parameter, date=None):
+        # Paths of all segments of the series (of one date), ordered by date and rotation
+        self.refresh()
+        dates = self._entries.get((coil, channel, parameter), {})
+        return [os.path.join(self.directory, segments[rotation])
+                for day, segments in sorted(dates.items()) if date is None or day == date
+                for rotation in sorted(segments)]
+
+    def series(self):
+        # (coil, channel, parameter, date) of every log, its segments counted once
+        self.refresh()
+        return sorted((*key, date) for key, dates in self._entries.items() for date in dates)
+
+    def dates(self, coil, channel, parameter):
+        self.refresh()
+        return sorted(self._entries.get((coil, channel, parameter), {}))
+
+    def coils(self):
+        self.refresh()
+        return sorted({key[0] for key in self._entries})
+
+    def channels(self, coil=None):
+        self.refresh()
+        return sorted({key[1] for key in self._entries if coil is None or key[0] == coil})
+
+    def parameters(self, coil=None, channel=None):
+        self.refresh()
+        return sorted({key[2] for key in self._entries
+                       if (coil is None or key[0] == coil) and (channel is None or key[1] == channel)})
+
+    def options(self, values):
+        # Dropdown options for a list of coil/channel/parameter names
+        return [{'label': value, 'value': value} for value in values]
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(directory='.'):
+    # One shared catalog per data directory
+    key = os.path.abspath(directory)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = LogCatalog(directory)
+        return _catalogs[key]
+
+
+def _reset_locks():
+    # A forked process (background job) only has the thread that forked it: a
+    # lock held by another thread of the worker would never be released there.
+    # The catalogs stay, they are only replaced as a whole in refresh().
+    global _catalogs_lock
+    _catalogs_lock = threading.Lock()
+    for catalog in _catalogs.values():
+        catalog._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks)
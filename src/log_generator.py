@@ -0,0 +1,108 @@
+import argparse
+import os
+import sys
+import numpy as np
+from log_index import LOG_HEADER_LINES
+
+# Synthetic coil logs in the exact format of the real ones: a header of
+# LOG_HEADER_LINES lines, then 'YYYY-MM-DD<TAB>HH:MM:SS.ffffff<TAB>value' rows.
+# A small share of the rows is replaced by the kinds of bad lines seen in the
+# field (extra fields, broken timestamps, non-numeric values, cut rows).
+# read_voltage_file, the original parser, can't handle non-numeric values (its
+# value column stays text), so logs meant for it are written with
+# bad_kinds=LEGACY_BAD_KINDS.
+#
+#   python log_generator.py <directory> [--coil KNEE_16] [--rows 100000]
+#                           [--interval-ms 1500] [--bad-lines 0.001] [--seed 0]
+#
+# writes one log per MSEQ0-3 x VDH/VDL/VLNA/VPIN, named like the real logs.
+
+CHANNELS = ['MSEQ0', 'MSEQ1', 'MSEQ2', 'MSEQ3']
+PARAMETERS = ['VDH', 'VDL', 'VLNA', 'VPIN']
+# Typical level and noise of every parameter
+LEVELS = {'VDH': (5.5, 0.05), 'VDL': (3.3, 0.03), 'VLNA': (2.5, 0.02), 'VPIN': (1.2, 0.01)}
+BAD_LINES = {
+    'fields': '{stamp}\t{value}\t0.0\textra',         # Too many fields
+    'timestamp': '2024-13-45\t25:61:00.000000\t{value}',  # Timestamp that does not parse
+    'value': '{stamp}\tERR',                           # Value that is not a number
+    'cut': '{stamp}',                                 # Row cut short
+}
+# The bad lines the original parser (read_voltage_file) copes with
+LEGACY_BAD_KINDS = ['fields', 'timestamp', 'cut']
+
+
+def header(coil, channel, parameter, rows):
+    lines = [
+        'ProCoil coil log',
+        f'Coil:\t{coil}',
+        f'Channel:\t{channel}',
+        f'Parameter:\t{parameter}',
+        f'Rows:\t{rows}',
+        'Generator:\tlog_generator.py',
+        'Unit:\tV',
+        '',
+        'Date\tTime\tValue',
+    ]
+    return lines[:LOG_HEADER_LINES]
+
+
+def log_rows(rows, start='2024-11-05T00:00:00', interval_ms=1500, level=5.0, noise=0.05,
+             bad_lines=0.001, bad_kinds=None, seed=0):
+    # The data rows of a log, as one string; bad_kinds limits the kinds of
+    # bad lines (keys of BAD_LINES, all of them by default)
+    kinds = list(BAD_LINES) if bad_kinds is None else list(bad_kinds)
+    rng = np.random.default_rng(seed)
+    times = np.datetime64(start, 'us') + np.arange(rows) * np.timedelta64(int(interval_ms * 1000), 'us')
+    stamps = np.char.replace(np.datetime_as_string(times, unit='us'), 'T', '\t')
+    # Slow wander plus noise; the sign flips like the raw readings do
+    values = level + np.cumsum(rng.normal(0, noise / 50, rows)) + rng.normal(0, noise, rows)
+    values *= np.where(rng.random(rows) < 0.5, -1, 1)
+    lines = np.char.add(np.char.add(stamps, '\t'), np.char.mod('%.5f', values)).astype(object)
+    bad = np.flatnonzero(rng.random(rows) < bad_lines) if kinds else []
+    for i, kind in zip(bad, rng.integers(0, max(len(kinds), 1), len(bad))):
+        lines[i] = BAD_LINES[kinds[kind]].format(stamp=stamps[i], value=f"{values[i]:.5f}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_log(path, rows, coil='KNEE_16', channel='MSEQ0', parameter='VDH', **options):
+    level, noise = LEVELS.get(parameter, (5.0, 0.05))
+    options.setdefault('level', level)
+    options.setdefault('noise', noise)
+    with open(path, 'w', newline='\n') as f:
+        f.write('\n'.join(header(coil, channel, parameter, rows)) + '\n')
+        f.write(log_rows(rows, **options))
+    return path
+
+
+def write_coil(directory, coil='KNEE_16', rows=100000, date='2024-11-05', channels=CHANNELS,
+               parameters=PARAMETERS, seed=0, **options):
+    # One log per channel and parameter; returns their paths
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i, channel in enumerate(channels):
+        for j, parameter in enumerate(parameters):
+            path = os.path.join(directory, f"{coil}_{channel}_{parameter}_{date}.txt")
+            paths.append(write_log(path, rows, coil, channel, parameter, start=f"{date}T00:00:00",
+                                   seed=seed + i * len(parameters) + j, **options))
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic coil logs.")
+    parser.add_argument('directory', help="Directory to write the logs to")
+    parser.add_argument('--coil', default='KNEE_16', help="Coil name used in the file names")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows per log")
+    parser.add_argument('--date', default='2024-11-05', help="Date of the first row")
+    parser.add_argument('--interval-ms', type=float, default=1500, help="Milliseconds between rows")
+    parser.add_argument('--bad-lines', type=float, default=0.001, help="Share of rows replaced by bad lines")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    args = parser.parse_args(argv)
+    paths = write_coil(args.directory, args.coil, args.rows, args.date, interval_ms=args.interval_ms,
+                       bad_lines=args.bad_lines, seed=args.seed)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"Wrote {len(paths)} logs of {args.rows} rows ({size / 1e6:.1f} MB) to {args.directory}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
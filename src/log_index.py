@@ -0,0 +1,200 @@
+import bisect
+import os
+import threading
+from datetime import datetime
+import numpy as np
+
+# Sparse time -> byte offset index of a coil log.
+#
+# Every INDEX_STRIDE bytes the first complete row is parsed and its timestamp
+# and line offset are remembered. Building it only reads one line per stride,
+# and when the log grows the index is extended from its last entry. A time
+# window then maps to a byte span that holds all of its rows, so only that
+# span has to be read and parsed. With PROCOIL_INDEX_STRIDE=0 no index is kept
+# and the span is found by binary search over the file instead.
+
+INDEX_STRIDE = int(os.environ.get('PROCOIL_INDEX_STRIDE', str(256 * 1024)))
+LOG_HEADER_LINES = 9
+
+
+def parse_timestamp(line):
+    # Nanoseconds since the epoch of a 'date<TAB>time<TAB>value' row, or None
+    parts = line.split(b'\t')
+    if len(parts) != 3:
+        return None
+    try:
+        moment = datetime.strptime(f"{parts[0].decode()} {parts[1].decode()}", '%Y-%m-%d %H:%M:%S.%f')
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return int(np.datetime64(moment, 'ns').astype(np.int64))
+
+
+def first_row_at(f, offset, limit, aligned=False):
+    # (timestamp, offset) of the first complete, parseable row after offset.
+    # Unless the offset is known to be a line start, the line it falls in is skipped.
+    f.seek(offset)
+    if not aligned:
+        f.readline()
+    while True:
+        position = f.tell()
+        if position >= limit:
+            return None
+        line = f.readline()
+        if not line.endswith(b'\n'):  # End of file or a row still being written
+            return None
+        timestamp = parse_timestamp(line)
+        if timestamp is not None:
+            return timestamp, position
+
+
+def data_start(f):
+    # Offset of the first row after the header
+    f.seek(0)
+    for _ in range(LOG_HEADER_LINES):
+        f.readline()
+    return f.tell()
+
+
+class LogIndex:
+
+    def __init__(self, path, stride=INDEX_STRIDE):
+        self.path = path
+        self.stride = stride
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.start = None   # Offset of the first row
+        self.size = 0       # Bytes of the log covered by the index
+        self.times = []
+        self.offsets = []
+
+    def update(self):
+        size = os.path.getsize(self.path)
+        with self._lock:
+            if size < self.size:  # Truncated or replaced
+                self._reset()
+            if size == self.size and self.start is not None:
+                return
+            with open(self.path, 'rb') as f:
+                if self.start is None:
+                    self.start = data_start(f)
+                if self.stride > 0:
+                    self._extend(f, size)
+            self.size = size
+
+    def _extend(self, f, size):
+        if self.offsets:
+            position, aligned = self.offsets[-1] + self.stride, False
+        else:
+            position, aligned = self.start, True
+        while position < size:
+            row = first_row_at(f, position, size, aligned)
+            if row is None:
+                break
+            timestamp, offset = row
+            # Rows are written in time order; skip anything that goes back in time
+            if not self.times or (timestamp >= self.times[-1] and offset > self.offsets[-1]):
+                self.times.append(timestamp)
+                self.offsets.append(offset)
+            position, aligned = offset + self.stride, False
+
+    def span(self, start=None, end=None):
+        # Byte range [low, high) holding every row with start <= time <= end (ns)
+        self.update()
+        with self._lock:
+            times, offsets = self.times, self.offsets
+            low, high = self.start, self.size
+            if not offsets:
+                with open(self.path, 'rb') as f:
+                    if start is not None:
+                        low = bisect_offset(f, start, low, high, before=True)
+                    if end is not None:
+                        high = bisect_offset(f, end, low, high, before=False)
+                return low, high
+            if start is not None:
+                i = bisect.bisect_left(times, start) - 1
+                if i >= 0:
+                    low = offsets[i]
+            if end is not None:
+                j = bisect.bisect_right(times, end)
+                if j < len(offsets):
+                    high = offsets[j]
+            return low, high
+
+    def first_timestamp(self):
+        # Time of the first complete row
+        self.update()
+        if self.times:
+            return self.times[0]
+        with open(self.path, 'rb') as f:
+            row = first_row_at(f, self.start, self.size, aligned=True)
+        return row[0] if row else None
+
+    def last_timestamp(self):
+        # Time of the last complete row, read from the end of the file
+        self.update()
+        with open(self.path, 'rb') as f:
+            block = 4096
+            while True:
+                position = max(self.size - block, self.start)
+                f.seek(position)
+                lines = f.read(self.size - position).split(b'\n')[:-1]
+                if position > self.start:
+                    lines = lines[1:]  # First line may be cut
+                for line in reversed(lines):
+                    timestamp = parse_timestamp(line)
+                    if timestamp is not None:
+                        return timestamp
+                if position == self.start:
+                    return None
+                block *= 4
+
+
+def bisect_offset(f, target, low, high, before):
+    # Offset of a line start from which to read rows >= target (before=True) or
+    # up to which rows <= target lie (before=False), by binary search on bytes
+    left, right = low, high
+    while right - left > 64 * 1024:
+        middle = (left + right) // 2
+        row = first_row_at(f, middle, right)
+        if row is None:
+            right = middle
+            continue
+        timestamp, offset = row
+        if (timestamp < target) if before else (timestamp <= target):
+            left = offset
+        else:
+            right = middle
+    if before:
+        return left
+    # Extend to the end of the line the search stopped in
+    f.seek(right)
+    if right > low:
+        f.readline()
+    return min(f.tell(), high)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path):
+    key = os.path.abspath(path)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = LogIndex(path)
+        return _indexes[key]
+
+
+def _reset_locks():
+    # A forked process (background job) has none of the worker's other threads,
+    # so their locks are replaced. An index caught in update() only covers less
+    # of its log and is extended on the next use.
+    global _indexes_lock
+    _indexes_lock = threading.Lock()
+    for index in _indexes.values():
+        index._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks)
@@ -0,0 +1,239 @@
+import os
+import threading
+import numpy as np
+from log_sidecar import SIDECAR_DIR
+
+# Multi-resolution aggregates (count, sum, min, max) of a coil log.
+#
+# Samples are bucketed per minute, and the minute buckets are rolled up into
+# hours and days. The pyramid is saved as <name>.pyramid.npz in the '.procoil'
+# folder next to the log together with the size and mtime of the log it was
+# built from. When the log only grew, just the buckets from the last saved
+# minute onwards are rebuilt. Statistics for any time window and coarse plot
+# data are then answered from the buckets; only the raw samples of the partial
+# minutes at the edges of a window are read for exact statistics.
+
+MINUTE = 60 * 10**9
+LEVELS = [('minute', MINUTE), ('hour', 60 * MINUTE), ('day', 24 * 60 * MINUTE)]
+FIELDS = ['start', 'count', 'sum', 'min', 'max']
+
+
+def aggregate(timestamps, values, width):
+    # Buckets of width nanoseconds over samples sorted by time
+    timestamps = np.asarray(timestamps).view('i8')
+    values = np.asarray(values, dtype=np.float64)
+    if len(timestamps) == 0:
+        return empty_level()
+    buckets = timestamps // width * width
+    starts, first = np.unique(buckets, return_index=True)
+    valid = ~np.isnan(values)
+    return {
+        'start': starts,
+        'count': np.add.reduceat(valid.astype(np.int64), first),
+        'sum': np.add.reduceat(np.where(valid, values, 0.0), first),
+        'min': np.minimum.reduceat(np.where(valid, values, np.inf), first),
+        'max': np.maximum.reduceat(np.where(valid, values, -np.inf), first),
+    }
+
+
+def roll_up(level, width):
+    # Coarser level built from the buckets of a finer one
+    if len(level['start']) == 0:
+        return empty_level()
+    starts, first = np.unique(level['start'] // width * width, return_index=True)
+    return {
+        'start': starts,
+        'count': np.add.reduceat(level['count'], first),
+        'sum': np.add.reduceat(level['sum'], first),
+        'min': np.minimum.reduceat(level['min'], first),
+        'max': np.maximum.reduceat(level['max'], first),
+    }
+
+
+def empty_level():
+    return {
+        'start': np.empty(0, dtype=np.int64),
+        'count': np.empty(0, dtype=np.int64),
+        'sum': np.empty(0, dtype=np.float64),
+        'min': np.empty(0, dtype=np.float64),
+        'max': np.empty(0, dtype=np.float64),
+    }
+
+
+def to_ns(bound):
+    return np.datetime64(bound, 'ns').astype(np.int64)
+
+
+class LogPyramid:
+
+    def __init__(self, minute, signature):
+        self.signature = signature  # (mtime_ns, size) of the log it was built from
+        self.levels = {'minute': minute}
+        for name, width in LEVELS[1:]:
+            self.levels[name] = roll_up(minute, width)
+
+    @classmethod
+    def build(cls, timestamps, values, signature):
+        return cls(aggregate(timestamps, values, MINUTE), signature)
+
+    def extend(self, timestamps, values, signature):
+        # Rebuild the buckets from the last saved minute onwards
+        minute = self.levels['minute']
+        if len(minute['start']) == 0:
+            return LogPyramid.build(timestamps, values, signature)
+        last = minute['start'][-1]
+        timestamps = np.asarray(timestamps).view('i8')
+        first = np.searchsorted(timestamps, last, side='left')
+        tail = aggregate(timestamps[first:], np.asarray(values)[first:], MINUTE)
+        keep = len(minute['start']) - 1
+        merged = {field: np.concatenate([minute[field][:keep], tail[field]]) for field in FIELDS}
+        return LogPyramid(merged, signature)
+
+    def _rows(self, level, window):
+        starts = self.levels[level]['start']
+        if not window:
+            return slice(0, len(starts))
+        width = dict(LEVELS)[level]
+        start, end = to_ns(window[0]), to_ns(window[1])
+        return slice(np.searchsorted(starts, start // width * width, side='left'),
+                     np.searchsorted(starts, end, side='right'))
+
+    def count(self, window=None):
+        return int(self.levels['minute']['count'][self._rows('minute', window)].sum())
+
+    def stats(self, window=None, samples=None):
+        # count, mean, min and max of the samples in window. Whole minutes are
+        # answered from the buckets; samples(start_ns, end_ns) returns the raw
+        # values of the partial minutes at the edges of the window, without it
+        # the edge minutes count in full (minute resolution).
+        level = self.levels['minute']
+        parts = []
+        if not window or samples is None:
+            rows = self._rows('minute', window)
+        else:
+            start, end = int(to_ns(window[0])), int(to_ns(window[1]))
+            whole_start = -(-start // MINUTE) * MINUTE   # First minute starting in the window
+            whole_end = (end + 1) // MINUTE * MINUTE     # End of the last minute ending in it
+            if whole_start >= whole_end:
+                rows = slice(0, 0)
+                parts.append(samples(start, end))
+            else:
+                starts = level['start']
+                rows = slice(np.searchsorted(starts, whole_start, side='left'),
+                             np.searchsorted(starts, whole_end, side='left'))
+                if start < whole_start:
+                    parts.append(samples(start, whole_start - 1))
+                if whole_end <= end:
+                    parts.append(samples(whole_end, end))
+        count = int(level['count'][rows].sum())
+        total = float(level['sum'][rows].sum())
+        low = float(level['min'][rows].min()) if count else np.inf
+        high = float(level['max'][rows].max()) if count else -np.inf
+        for values in parts:
+            values = np.asarray(values, dtype=np.float64)
+            values = values[~np.isnan(values)]
+            if len(values):
+                count += len(values)
+                total += float(values.sum())
+                low = min(low, float(values.min()))
+                high = max(high, float(values.max()))
+        if count == 0:
+            return {'count': 0, 'mean': np.nan, 'min': np.nan, 'max': np.nan}
+        return {'count': count, 'mean': total / count, 'min': low, 'max': high}
+
+    def trace(self, window=None, max_points=4000):
+        # Min/max envelope within the point budget, drawn at the middle of the
+        # buckets. The finest level that is not far over the budget is used and
+        # neighbouring buckets are merged until it fits.
+        for name, width in LEVELS:
+            rows = self._rows(name, window)
+            level = self.levels[name]
+            used = level['count'][rows] > 0
+            if used.sum() <= 50 * max_points or name == LEVELS[-1][0]:
+                break
+        starts = level['start'][rows][used]
+        lows = level['min'][rows][used]
+        highs = level['max'][rows][used]
+        group = max(-(-len(starts) // max(max_points // 2, 1)), 1)
+        first = np.arange(0, len(starts), group)
+        if len(starts) == 0:
+            return starts.view('datetime64[ns]'), lows.astype(np.float32)
+        ends = starts[np.append(first[1:] - 1, len(starts) - 1)] + width
+        middle = (starts[first] + ends) // 2
+        lows = np.minimum.reduceat(lows, first)
+        highs = np.maximum.reduceat(highs, first)
+        x = np.repeat(middle, 2).view('datetime64[ns]')
+        y = np.column_stack([lows, highs]).ravel()
+        return x, y.astype(np.float32)
+
+    def save(self, path):
+        # Only the minute level is stored, the coarser ones are rolled up on load
+        arrays = {f"minute_{field}": self.levels['minute'][field] for field in FIELDS}
+        arrays['signature'] = np.asarray(self.signature, dtype=np.int64)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            minute = {field: data[f"minute_{field}"] for field in FIELDS}
+            return cls(minute, tuple(int(v) for v in data['signature']))
+
+
+def pyramid_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, SIDECAR_DIR, name + '.pyramid.npz')
+
+
+_pyramids = {}
+_pyramids_lock = threading.Lock()
+
+
+def _reset_lock():
+    # A forked process (background job) has none of the worker's other threads
+    global _pyramids_lock
+    _pyramids_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock)
+
+
+def get_pyramid(path, load, value_name='value', load_since=None):
+    # Pyramid for the log at path; load(path) returns the parsed frame and is
+    # only called when the saved pyramid is missing or older than the log.
+    # When the log grew, load_since(path, start_ns) may return just its tail.
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    key = os.path.abspath(path)
+    with _pyramids_lock:
+        pyramid = _pyramids.get(key)
+    if pyramid is None or pyramid.signature != signature:
+        # Another worker may already have saved an up to date pyramid
+        try:
+            pyramid = LogPyramid.load(pyramid_path(path))
+        except (OSError, ValueError, KeyError):
+            pass
+    if pyramid is not None and pyramid.signature == signature:
+        with _pyramids_lock:
+            _pyramids[key] = pyramid
+        return pyramid
+
+    grew = pyramid is not None and signature[1] > pyramid.signature[1]
+    if grew and load_since is not None and len(pyramid.levels['minute']['start']):
+        df = load_since(path, int(pyramid.levels['minute']['start'][-1]))
+    else:
+        df = load(path)
+    timestamps, values = df['datetime'].to_numpy(), df[value_name].to_numpy()
+    if grew:
+        pyramid = pyramid.extend(timestamps, values, signature)
+    else:
+        pyramid = LogPyramid.build(timestamps, values, signature)
+    try:
+        os.makedirs(os.path.dirname(pyramid_path(path)), exist_ok=True)
+        pyramid.save(pyramid_path(path))
+    except OSError as e:
+        print(f"Could not save pyramid for {path}: {e}")
+    with _pyramids_lock:
+        _pyramids[key] = pyramid
+    return pyramid
@@ -0,0 +1,118 @@
+import gzip
+import io
+import os
+import threading
+import zstandard
+from log_index import LOG_HEADER_LINES, get_index, parse_timestamp
+
+# Coil logs that are split over several files (segments): the live log and the
+# parts rotated away from it, which may be compressed with gzip (.gz) or
+# Zstandard (.zst).
+#
+# Compressed segments are decompressed as a stream while they are parsed. A
+# segment covers the time from its first row up to the first row of the next
+# segment, so only the first rows of every segment are read to find the
+# segments that overlap a time window; the others are never decompressed.
+
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+# Rows read from the start of a segment to find its first timestamp
+FIRST_ROW_LINES = 100
+READ_BUFFER = 1 << 20
+
+_bounds = {}  # (path, 'first'/'last') -> ((mtime_ns, size), timestamp in ns)
+_bounds_lock = threading.Lock()
+
+
+def _reset_lock():
+    # A forked process (background job) has none of the worker's other threads
+    global _bounds_lock
+    _bounds_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock)
+
+
+def compression(path):
+    # 'gzip', 'zstd' or None for a plain log
+    return COMPRESSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def open_log(path):
+    # Binary stream of the log text, decompressed on the fly
+    kind = compression(path)
+    if kind == 'gzip':
+        return gzip.open(path, 'rb')
+    if kind == 'zstd':
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader, READ_BUFFER)
+    return open(path, 'rb')
+
+
+def _cached(path, which, find):
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _bounds_lock:
+        cached = _bounds.get((path, which))
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    timestamp = find(path)
+    with _bounds_lock:
+        _bounds[(path, which)] = (signature, timestamp)
+    return timestamp
+
+
+def _first_row(path):
+    with open_log(path) as f:
+        for _ in range(LOG_HEADER_LINES):
+            f.readline()
+        for _ in range(FIRST_ROW_LINES):
+            line = f.readline()
+            if not line:
+                return None
+            timestamp = parse_timestamp(line)
+            if timestamp is not None:
+                return timestamp
+    return None
+
+
+def _last_row(path):
+    # Compressed segments are read to the end, keeping only the last block
+    with open_log(path) as f:
+        tail = b''
+        for block in iter(lambda: f.read(READ_BUFFER), b''):
+            tail = (tail + block)[-65536:]
+    for line in reversed(tail.split(b'\n')[1:-1]):  # The first and last line may be cut
+        timestamp = parse_timestamp(line)
+        if timestamp is not None:
+            return timestamp
+    return None
+
+
+def first_timestamp(path):
+    # Time of the first row in ns, None if the segment has no rows
+    if compression(path) is None:
+        return get_index(path).first_timestamp()
+    return _cached(path, 'first', _first_row)
+
+
+def last_timestamp(path):
+    # Time of the last row in ns, None if the segment has no rows
+    if compression(path) is None:
+        return get_index(path).last_timestamp()
+    return _cached(path, 'last', _last_row)
+
+
+def segments_in(paths, start=None, end=None):
+    # The segments among paths, in time order, holding rows with
+    # start <= time <= end (ns); all of them without bounds
+    firsts = sorted((first, path) for first, path in ((first_timestamp(path), path) for path in paths)
+                    if first is not None)
+    chosen = []
+    for i, (first, path) in enumerate(firsts):
+        following = firsts[i + 1][0] if i + 1 < len(firsts) else None
+        if end is not None and first > end:
+            continue
+        if start is not None and following is not None and following <= start:
+            continue
+        chosen.append(path)
+    return chosen
@@ -0,0 +1,179 @@
+import argparse
+import os
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+from log_catalog import parse_log_name
+
+# Binary columnar copies of parsed coil logs.
+#
+# For every log a pair of .npy files is kept in a hidden '.procoil' folder next
+# to it: <name>.datetime.npy (datetime64[ns]) and <name>.value.npy (float32).
+# They are opened with mmap, so loading is near zero-copy and all gunicorn
+# workers share the same pages of the OS page cache. A sidecar is only used
+# while it is newer than its source log.
+#
+# The sidecars of a folder form one store shared by all workers, bounded by
+# PROCOIL_SHARED_MB in total. Loading a sidecar records the use in its access
+# time (its mtime marks freshness), and after every write the least recently
+# used sidecars are removed until the store fits. Workers that still map a
+# removed sidecar keep their pages until they let go of the frame.
+#
+# Bulk conversion of an existing directory:
+#   python log_sidecar.py <directory> [--recursive] [--force]
+
+SIDECAR_DIR = '.procoil'
+# Set PROCOIL_SIDECARS=0 to stop File/File_2 from writing sidecars
+SIDECARS_ENABLED = os.environ.get('PROCOIL_SIDECARS', '1') != '0'
+# Size of the sidecars kept per folder, 0 for no limit
+SHARED_BUDGET_MB = int(os.environ.get('PROCOIL_SHARED_MB', '4096'))
+# Uses closer together than this are not recorded again
+USE_RESOLUTION_NS = 60 * 10**9
+
+
+def sidecar_paths(path):
+    directory, name = os.path.split(path)
+    base = os.path.join(directory, SIDECAR_DIR, name)
+    return base + '.datetime.npy', base + '.value.npy'
+
+
+def is_fresh(path):
+    try:
+        source_mtime = os.stat(path).st_mtime_ns
+        return all(os.stat(sidecar).st_mtime_ns > source_mtime for sidecar in sidecar_paths(path))
+    except OSError:
+        return False
+
+
+def load_sidecar(path, value_name='value'):
+    # Memory-mapped frame for path, or None if there is no fresh sidecar
+    if not is_fresh(path):
+        return None
+    datetime_path, value_path = sidecar_paths(path)
+    try:
+        datetimes = np.load(datetime_path, mmap_mode='r')
+        values = np.load(value_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if len(datetimes) != len(values):  # Caught between the two writes
+        return None
+    mark_used(datetime_path)
+    df = pd.DataFrame({'datetime': datetimes, value_name: values}, copy=False)
+    df.attrs['shared'] = True  # Backed by the shared store, not by worker memory
+    return df
+
+
+def mark_used(sidecar):
+    try:
+        stat = os.stat(sidecar)
+        now = time.time_ns()
+        if now - stat.st_atime_ns > USE_RESOLUTION_NS:
+            os.utime(sidecar, ns=(now, stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def write_sidecar(path, df, value_name='value', source_mtime_ns=None, enforce=True):
+    # source_mtime_ns is the log mtime seen before parsing; the sidecar is stamped
+    # just after it, so a log that grew while being parsed stays newer than it.
+    # With enforce the store is brought back within its budget afterwards.
+    if source_mtime_ns is None:
+        source_mtime_ns = os.stat(path).st_mtime_ns
+    datetime_path, value_path = sidecar_paths(path)
+    os.makedirs(os.path.dirname(datetime_path), exist_ok=True)
+    columns = [
+        (datetime_path, np.asarray(df['datetime'], dtype='datetime64[ns]')),
+        (value_path, np.asarray(df[value_name], dtype=np.float32)),
+    ]
+    for sidecar, array in columns:
+        # Write to a temporary file first so readers never see a partial array
+        temp_path = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, array)
+        os.utime(temp_path, ns=(time.time_ns(), source_mtime_ns + 1))
+        os.replace(temp_path, sidecar)
+    if enforce and SHARED_BUDGET_MB > 0:
+        enforce_budget(os.path.dirname(datetime_path), SHARED_BUDGET_MB * 1024 * 1024, keep=datetime_path)
+
+
+def enforce_budget(sidecar_dir, max_bytes, keep=None):
+    # Remove the least recently used sidecar pairs of the folder until the rest
+    # fits into max_bytes; the pair of keep (a .datetime.npy path) stays
+    pairs = []
+    total = 0
+    with os.scandir(sidecar_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.datetime.npy'):
+                continue
+            value_path = entry.path[:-len('.datetime.npy')] + '.value.npy'
+            try:
+                stat = entry.stat()
+                size = stat.st_size + os.path.getsize(value_path)
+            except OSError:
+                continue
+            pairs.append((stat.st_atime_ns, size, entry.path, value_path))
+            total += size
+    removed = 0
+    for _, size, datetime_path, value_path in sorted(pairs):
+        if total <= max_bytes:
+            break
+        if datetime_path == keep:
+            continue
+        for sidecar in (datetime_path, value_path):
+            try:
+                os.remove(sidecar)
+            except FileNotFoundError:  # Removed by another worker
+                pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def convert_directory(directory, recursive=False, force=False):
+    from coil_functions import read_log
+
+    converted = skipped = failed = 0
+    sidecar_dirs = set()
+    started = time.time()
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if recursive and not d.startswith('.')]
+        for name in sorted(files):
+            if parse_log_name(name) is None:
+                continue
+            path = os.path.join(root, name)
+            if not force and is_fresh(path):
+                skipped += 1
+                continue
+            try:
+                source_mtime_ns = os.stat(path).st_mtime_ns
+                write_sidecar(path, read_log(path), source_mtime_ns=source_mtime_ns, enforce=False)
+                sidecar_dirs.add(os.path.join(root, SIDECAR_DIR))
+                converted += 1
+                print(f"Converted {path}")
+            except Exception as e:
+                failed += 1
+                print(f"Error converting {path}: {e}")
+    # The budget is applied once at the end instead of after every sidecar
+    removed = 0
+    if SHARED_BUDGET_MB > 0:
+        for sidecar_dir in sorted(sidecar_dirs):
+            removed += enforce_budget(sidecar_dir, SHARED_BUDGET_MB * 1024 * 1024)
+    print(f"{converted} converted, {skipped} up to date, {failed} failed in {time.time() - started:.1f} s")
+    if removed:
+        print(f"{removed} least recently used sidecars removed to stay within PROCOIL_SHARED_MB={SHARED_BUDGET_MB}")
+    return failed == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert coil logs into memory-mapped .npy sidecars.")
+    parser.add_argument('directory', nargs='?', default='.', help="Directory with the coil logs")
+    parser.add_argument('--recursive', action='store_true', help="Also convert logs in subdirectories")
+    parser.add_argument('--force', action='store_true', help="Rewrite sidecars that are up to date")
+    args = parser.parse_args(argv)
+    return 0 if convert_directory(args.directory, args.recursive, args.force) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import io
+import os
+from log_index import data_start
+
+# Incremental reads of coil logs that are still being written.
+#
+# The caller keeps the byte offset up to which a log has been read. Every call
+# parses only what was appended since then, up to the last complete row; a
+# trailing row without its newline is left for the next call.
+
+LIVE_INTERVAL_MS = int(os.environ.get('PROCOIL_LIVE_INTERVAL_MS', '5000'))
+# Points kept per trace in live mode, older points are dropped by the browser
+LIVE_MAX_POINTS = int(os.environ.get('PROCOIL_LIVE_MAX_POINTS', '50000'))
+# Largest chunk read per call, so catching up on a big backlog is spread over ticks
+MAX_TAIL_BYTES = 16 * 1024 * 1024
+
+
+def end_offset(path):
+    # Offset just after the last complete row
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            newline = f.read(step).rfind(b'\n')
+            if newline >= 0:
+                return position + newline + 1
+    return 0
+
+
+def read_appended(path, offset, parse):
+    # (parsed rows appended after offset or None, new offset). parse(buffer)
+    # turns a buffer of complete rows into a frame.
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        start = data_start(f)
+        if offset is None or offset < start or size < offset:
+            offset = start  # New, truncated or rotated log: read it from the top
+        if size == offset:
+            return None, offset
+        f.seek(offset)
+        chunk = f.read(min(size - offset, MAX_TAIL_BYTES))
+    end = chunk.rfind(b'\n') + 1
+    if end == 0:
+        return None, offset
+    return parse(io.BytesIO(chunk[:end])), offset + end
@@ -0,0 +1,328 @@
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Timing and size metrics, served in the Prometheus text format on /metrics.
+#
+#   procoil_stage_seconds{stage}               time of the loading stages: 'scan'
+#                                              (directory listing), 'parse' (CSV),
+#                                              'datetime' (timestamp conversion),
+#                                              'figure' and 'json' (serialisation)
+#   procoil_callback_seconds{callback}         Dash callback requests, by first output
+#   procoil_callback_response_bytes{callback}  size of their responses
+#   procoil_job_seconds{callback}              background callback jobs
+#
+# Every process (gunicorn workers and the processes of background jobs) keeps
+# its own histograms. A worker writes them to .procoil/metrics/<pid>-<id>.json;
+# a background job adds them to finished.json when it ends, as do the workers
+# for the files of processes that have exited, so there is one file per live
+# worker plus finished.json. /metrics adds up these files, so it answers the
+# same in every worker. With PROCOIL_SLOW_REQUEST_MS set, requests and jobs
+# slower than that are printed with the time spent in each stage.
+
+METRICS_DIR = os.environ.get('PROCOIL_METRICS_DIR', os.path.join('.procoil', 'metrics'))
+# Histograms of the processes that have ended
+FINISHED_FILE = 'finished.json'
+SLOW_REQUEST_MS = float(os.environ.get('PROCOIL_SLOW_REQUEST_MS', '0'))
+# Seconds between two writes of the metrics of a process
+FLUSH_INTERVAL = 1.0
+TIME_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7]
+METRICS = {
+    'procoil_stage_seconds': ('Time spent in each loading and rendering stage', TIME_BUCKETS),
+    'procoil_callback_seconds': ('Time of Dash callback requests', TIME_BUCKETS),
+    'procoil_callback_response_bytes': ('Size of Dash callback responses', SIZE_BUCKETS),
+    'procoil_job_seconds': ('Time of background callback jobs', TIME_BUCKETS),
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (metric, label name, label value) -> [bucket counts..., count, sum]
+_process = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_last_flush = 0.0
+# Stages timed for the request or job that is running, for the slow log
+_trace = contextvars.ContextVar('procoil_trace', default=None)
+
+
+def _reset_after_fork():
+    # A forked process reports only what it measures itself
+    global _lock, _histograms, _process, _last_flush
+    _lock = threading.Lock()
+    _histograms = {}
+    _process = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    _last_flush = 0.0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def observe(metric, label, value, amount):
+    buckets = METRICS[metric][1]
+    with _lock:
+        counts = _histograms.setdefault((metric, label, value), [0] * (len(buckets) + 2))
+        for i, bound in enumerate(buckets):
+            if amount <= bound:
+                counts[i] += 1
+        counts[-2] += 1
+        counts[-1] += amount
+
+
+@contextmanager
+def span(stage):
+    # Time a stage of the current request or job
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('procoil_stage_seconds', 'stage', stage, elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+@contextmanager
+def request_trace():
+    # Collect the stages timed until the end of the block, also in threads
+    # started with contextvars.copy_context()
+    trace = []
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def stage_summary(trace):
+    totals = {}
+    for stage, elapsed in trace:
+        total, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + elapsed, count + 1)
+    return ', '.join(f"{stage} {total * 1000:.0f} ms ({count}x)" for stage, (total, count) in totals.items())
+
+
+def log_if_slow(kind, callback, elapsed, trace, size=None):
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        size_text = f", {size} bytes" if size is not None else ''
+        print(f"Slow {kind} {callback}: {elapsed * 1000:.0f} ms{size_text}; {stage_summary(trace) or 'no stages timed'}")
+
+
+def flush(force=False):
+    # Write the histograms of this process for /metrics
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    with _lock:
+        entries = [[metric, label, value, counts] for (metric, label, value), counts in _histograms.items()]
+    if not entries:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        write_entries(os.path.join(METRICS_DIR, f"{_process}.json"), entries)
+    except OSError as e:
+        print(f"Could not write metrics: {e}")
+
+
+def write_entries(path, entries):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(entries, f)
+    os.replace(temp_path, path)
+
+
+def read_entries(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def add_entries(totals, entries):
+    for metric, label, value, counts in entries:
+        if metric not in METRICS:
+            continue
+        total = totals.setdefault((metric, label, value), [0] * len(counts))
+        for i, count in enumerate(counts):
+            total[i] += count
+
+
+@contextmanager
+def finished_lock():
+    # Held by the process that updates finished.json
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, 'finished.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def add_to_finished(entries, remove=()):
+    # Add entries to finished.json and delete the process files in remove
+    path = os.path.join(METRICS_DIR, FINISHED_FILE)
+    totals = {}
+    add_entries(totals, read_entries(path))
+    add_entries(totals, entries)
+    write_entries(path, [[metric, label, value, counts] for (metric, label, value), counts in totals.items()])
+    for name in remove:
+        try:
+            os.remove(os.path.join(METRICS_DIR, name))
+        except OSError:
+            pass
+
+
+def process_running(name):
+    # Whether the process that writes the file <pid>-<id>.json is still running
+    try:
+        os.kill(int(name.split('-')[0]), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, OSError):
+        return True  # Not a process file, or a process of another user
+    return True
+
+
+def finish_process():
+    # Hand the histograms of a process that is about to end over to finished.json
+    with _lock:
+        entries = [[metric, label, value, counts] for (metric, label, value), counts in _histograms.items()]
+        _histograms.clear()
+    try:
+        with finished_lock():
+            add_to_finished(entries, [f"{_process}.json"])
+    except OSError as e:
+        print(f"Could not write metrics: {e}")
+
+
+def compact():
+    # Fold the files of processes that have exited into finished.json
+    try:
+        names = [name for name in os.listdir(METRICS_DIR)
+                 if name.endswith('.json') and name != FINISHED_FILE and name != f"{_process}.json"]
+        with finished_lock():
+            ended = [name for name in names if not process_running(name)]
+            if ended:
+                entries = []
+                for name in ended:
+                    entries.extend(read_entries(os.path.join(METRICS_DIR, name)))
+                add_to_finished(entries, ended)
+    except OSError as e:
+        print(f"Could not compact metrics: {e}")
+
+
+def collect():
+    # Histograms of all processes added up
+    flush(force=True)
+    compact()
+    totals = {}
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        names = []
+    for name in names:
+        if name.endswith('.json'):
+            add_entries(totals, read_entries(os.path.join(METRICS_DIR, name)))
+    return totals
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render():
+    # Prometheus text exposition format
+    totals = collect()
+    lines = []
+    for metric, (description, buckets) in METRICS.items():
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} histogram")
+        for (name, label, value), counts in sorted(totals.items()):
+            if name != metric:
+                continue
+            labels = f'{label}="{escape(value)}"'
+            for bound, count in zip(buckets, counts):
+                lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {count}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {counts[-2]}')
+            lines.append(f'{metric}_sum{{{labels}}} {counts[-1]:.6f}')
+            lines.append(f'{metric}_count{{{labels}}} {counts[-2]}')
+    return '\n'.join(lines) + '\n'
+
+
+def callback_name(outputs):
+    # 'id.property' of the first output of a callback (outputs as sent by Dash)
+    while isinstance(outputs, list) and outputs:
+        outputs = outputs[0]
+    if not isinstance(outputs, dict):
+        return 'unknown'
+    component = outputs.get('id')
+    if isinstance(component, dict):  # Pattern-matching id
+        component = json.dumps(component, sort_keys=True)
+    return f"{component}.{outputs.get('property')}"
+
+
+def timed_job(job_fn, callback):
+    # Wrap the function of a background job, which runs in its own process
+    def run(*args):
+        with request_trace() as trace:
+            started = time.perf_counter()
+            try:
+                job_fn(*args)
+            finally:
+                elapsed = time.perf_counter() - started
+                observe('procoil_job_seconds', 'callback', callback, elapsed)
+                log_if_slow('job', callback, elapsed, trace)
+                finish_process()
+    return run
+
+
+def instrument(app):
+    # Time every Dash callback request of app and serve /metrics on its server
+    import flask
+    import dash._callback
+
+    server = app.server
+    serialize = dash._callback.to_json
+
+    def timed_to_json(obj, *args, **kwargs):
+        with span('json'):
+            return serialize(obj, *args, **kwargs)
+
+    # Dash serialises callback outputs with this function; wrapped to time it
+    dash._callback.to_json = timed_to_json
+
+    @server.before_request
+    def start_timer():
+        if flask.request.path.endswith('/_dash-update-component'):
+            flask.g.procoil_trace = request_trace()
+            flask.g.procoil_trace_list = flask.g.procoil_trace.__enter__()
+            flask.g.procoil_started = time.perf_counter()
+
+    @server.after_request
+    def record_request(response):
+        started = flask.g.pop('procoil_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        body = flask.request.get_json(silent=True) or {}
+        callback = callback_name(body.get('outputs'))
+        size = response.calculate_content_length() or 0
+        observe('procoil_callback_seconds', 'callback', callback, elapsed)
+        observe('procoil_callback_response_bytes', 'callback', callback, size)
+        log_if_slow('request', callback, elapsed, flask.g.procoil_trace_list, size)
+        flask.g.pop('procoil_trace').__exit__(None, None, None)
+        flush()
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(render(), mimetype='text/plain; version=0.0.4')
+
+    return app
@@ -0,0 +1,220 @@
+import io
+import os
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# MQTT ingestion of coil samples into in-memory ring buffers.
+#
+# Samples are published on '<prefix>/<coil>/<channel>/<parameter>' with one or
+# more log rows as payload ('YYYY-MM-DD<TAB>HH:MM:SS.ffffff<TAB>value', one per
+# line), the same format as the rows of the log files. Messages are queued by
+# the paho network thread and parsed in batches by a worker thread, which
+# appends them to a fixed-size ring buffer per series. When the queue is full,
+# new messages are dropped and counted instead of blocking the network thread.
+#
+# Started from app.py when PROCOIL_MQTT_HOST is set. Every gunicorn worker runs
+# its own subscriber and buffers.
+
+MQTT_HOST = os.environ.get('PROCOIL_MQTT_HOST', '')
+MQTT_PORT = int(os.environ.get('PROCOIL_MQTT_PORT', '1883'))
+MQTT_TOPIC_PREFIX = os.environ.get('PROCOIL_MQTT_PREFIX', 'procoil')
+# Samples kept per series
+RING_CAPACITY = int(os.environ.get('PROCOIL_RING_CAPACITY', '200000'))
+# Messages waiting to be parsed before new ones are dropped
+QUEUE_SIZE = int(os.environ.get('PROCOIL_MQTT_QUEUE', '10000'))
+BATCH_SIZE = 500
+BATCH_SECONDS = 0.5
+
+
+class RingBuffer:
+    # Fixed-size time series; the oldest samples are overwritten when it is full
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.position = 0   # Next slot to write
+        self.count = 0
+        self.overwritten = 0
+        self._lock = threading.Lock()
+
+    def extend(self, timestamps, values):
+        received = len(timestamps)  # Samples beyond the capacity are overwritten right away
+        timestamps = np.asarray(timestamps).view('i8')[-self.capacity:]
+        values = np.asarray(values, dtype=np.float32)[-self.capacity:]
+        n = len(timestamps)
+        with self._lock:
+            # Write in at most two slices, wrapping around the end
+            first = min(n, self.capacity - self.position)
+            self.timestamps[self.position:self.position + first] = timestamps[:first]
+            self.values[self.position:self.position + first] = values[:first]
+            self.timestamps[:n - first] = timestamps[first:]
+            self.values[:n - first] = values[first:]
+            self.position = (self.position + n) % self.capacity
+            self.overwritten += max(self.count + received - self.capacity, 0)
+            self.count = min(self.count + n, self.capacity)
+
+    def snapshot(self):
+        # Copies of the samples in time order
+        with self._lock:
+            start = (self.position - self.count) % self.capacity
+            order = (start + np.arange(self.count)) % self.capacity
+            return self.timestamps[order], self.values[order]
+
+
+class RingStore:
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self._buffers = {}  # (coil, channel, parameter) -> RingBuffer
+        self._lock = threading.Lock()
+
+    def buffer(self, coil, channel, parameter, create=False):
+        key = (coil, channel, parameter)
+        with self._lock:
+            if create and key not in self._buffers:
+                self._buffers[key] = RingBuffer(self.capacity)
+            return self._buffers.get(key)
+
+    def frame(self, coil, channel, parameter, value_name='value'):
+        # Same columns as File()/File_2(), or None if nothing was received
+        buffer = self.buffer(coil, channel, parameter)
+        if buffer is None or buffer.count == 0:
+            return None
+        timestamps, values = buffer.snapshot()
+        order = np.argsort(timestamps, kind='stable')  # Messages can arrive out of order
+        return pd.DataFrame({
+            'datetime': timestamps[order].view('datetime64[ns]'),
+            value_name: values[order],
+        })
+
+    def series(self):
+        with self._lock:
+            return sorted(self._buffers)
+
+    def reset_after_fork(self):
+        # A forked process (background job) has no MQTT thread and none of the
+        # worker's other threads, so no lock may stay held. Its buffers keep
+        # the samples received up to the fork.
+        self._lock = threading.Lock()
+        for buffer in self._buffers.values():
+            buffer._lock = threading.Lock()
+
+
+class MqttIngest:
+    # Subscriber feeding a RingStore. A client with the paho interface can be
+    # passed in, e.g. a fake one for tests; otherwise a paho client is created.
+
+    def __init__(self, store, host=MQTT_HOST, port=MQTT_PORT, prefix=MQTT_TOPIC_PREFIX,
+                 client=None, queue_size=QUEUE_SIZE):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.client = client
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.received = 0
+        self.dropped = 0      # Messages dropped because the queue was full
+        self.rejected = 0     # Messages with an unknown topic or no valid row
+        self.samples = 0
+        self._stop = threading.Event()
+        self._worker = None
+
+    def start(self):
+        if self.client is None:
+            import paho.mqtt.client as mqtt
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self._worker = threading.Thread(target=self.run, name='procoil-mqtt', daemon=True)
+        self._worker.start()
+        if self.host:
+            self.client.connect_async(self.host, self.port)
+            self.client.loop_start()
+
+    def stop(self):
+        self._stop.set()
+        if self.host:
+            self.client.loop_stop()
+            self.client.disconnect()
+        if self._worker is not None:
+            self._worker.join()
+
+    def on_connect(self, client, userdata, flags, reason_code, properties=None):
+        client.subscribe(f"{self.prefix}/+/+/+")
+
+    def on_message(self, client, userdata, message):
+        # Runs on the network thread: only queue the message
+        self.received += 1
+        try:
+            self.queue.put_nowait((message.topic, message.payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while not self._stop.is_set() or not self.queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self.ingest(batch)
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + BATCH_SECONDS
+        while len(batch) < BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def ingest(self, batch):
+        # Parse the payloads of each series together and append them in one go
+        from coil_functions import read_log
+
+        payloads = {}
+        for topic, payload in batch:
+            parts = topic.split('/')
+            if len(parts) != 4 or parts[0] != self.prefix:
+                self.rejected += 1
+                continue
+            rows = payload if payload.endswith(b'\n') else payload + b'\n'
+            payloads.setdefault(tuple(parts[1:]), []).append(rows)
+        for key, rows in payloads.items():
+            df = read_log(io.BytesIO(b''.join(rows)), skiprows=0)
+            if df.empty:
+                self.rejected += len(rows)
+                continue
+            self.store.buffer(*key, create=True).extend(df['datetime'].to_numpy(), df['value'].to_numpy())
+            self.samples += len(df)
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'samples': self.samples,
+            'queued': self.queue.qsize(),
+            'overwritten': sum(self.store.buffer(*key).overwritten for key in self.store.series()),
+        }
+
+
+# Shared store read by the Coil-Voltages pages
+ring_store = RingStore()
+os.register_at_fork(after_in_child=ring_store.reset_after_fork)
+_ingest = None
+
+
+def start_from_environment():
+    # Start the subscriber if PROCOIL_MQTT_HOST is set
+    global _ingest
+    if MQTT_HOST and _ingest is None:
+        _ingest = MqttIngest(ring_store)
+        _ingest.start()
+        print(f"Subscribed to {MQTT_TOPIC_PREFIX}/# on {MQTT_HOST}:{MQTT_PORT}")
+    return _ingest
@@ -0,0 +1,127 @@
+import dash
+from dash import dcc, html, dash_table, Input, Output, State, callback
+from coil_compare import compare_series
+from coil_figures import comparison_figure
+from log_catalog import get_catalog
+from coil_voltages import RANGE_OPTIONS
+from background_jobs import background_manager
+from metrics import span
+
+# Register the page
+dash.register_page(__name__)
+
+# Common time grid step, None picks one from the length of the range
+STEP_OPTIONS = [
+    {'label': 'Automatic step', 'value': 0},
+    {'label': '1 second', 'value': 1},
+    {'label': '10 seconds', 'value': 10},
+    {'label': '1 minute', 'value': 60},
+    {'label': '10 minutes', 'value': 600},
+    {'label': '1 hour', 'value': 3600}
+]
+# Columns of the statistics table, with their headers
+COLUMNS = [
+    ('series', 'Series'), ('coverage', 'Coverage'), ('samples', 'Samples'), ('offset', 'Offset'),
+    ('rms_difference', 'RMS difference'), ('correlation', 'Correlation'),
+    ('best_lag_s', 'Best lag (s)'), ('best_lag_correlation', 'Correlation at best lag'),
+]
+
+
+# Layout, built on every visit so the dropdowns list the logs found now
+def layout(**kwargs):
+    catalog = get_catalog('.')
+    return html.Div([
+        html.P("Compare coils on a common time grid; the first selected coil and RXE is the reference"),
+        dcc.Dropdown(
+            id='compare-coil-dropdown',
+            options=catalog.options(catalog.coils()),
+            multi=True,
+            placeholder="Select the coils",
+            style={'width': '50%', 'margin': '0 auto'}
+        ),
+        html.Hr(style={'border': '3px solid green', 'margin': '10px auto', 'width': '60%'}),
+        dcc.Dropdown(
+            id='compare-rxe-dropdown',
+            options=catalog.options(catalog.channels()),
+            multi=True,
+            placeholder="Select the RXE options",
+            style={'width': '50%', 'margin': '0 auto', 'color': 'blue'}
+        ),
+        dcc.Dropdown(
+            id='compare-voltage-dropdown',
+            options=catalog.options(catalog.parameters()),
+            placeholder="Select the voltage",
+            style={'width': '50%', 'margin': '0 auto', 'color': 'blue'}
+        ),
+        dcc.Dropdown(
+            id='compare-range-dropdown',
+            options=RANGE_OPTIONS,
+            value=0,  # Whole logs by default
+            clearable=False,
+            style={'width': '50%', 'margin': '0 auto', 'color': 'blue'}
+        ),
+        dcc.Dropdown(
+            id='compare-step-dropdown',
+            options=STEP_OPTIONS,
+            value=0,
+            clearable=False,
+            style={'width': '50%', 'margin': '0 auto', 'color': 'blue'}
+        ),
+        dcc.RadioItems(
+            id='compare-mode-radio',
+            options=[{'label': ' Overlay', 'value': 'overlay'},
+                     {'label': ' Difference to the reference', 'value': 'difference'}],
+            value='overlay',
+            inline=True,
+            style={'marginTop': '10px'}
+        ),
+        html.Button('Compare', id='compare-button', n_clicks=0, style={'marginTop': '20px'}),
+        html.Hr(style={'border': '3px solid blue', 'margin': '10px auto', 'width': '60%'}),
+        dcc.Graph(id='compare-graph'),
+        html.Div("Click the 'Compare' button to start.", id='compare-output-div', style={'marginTop': '20px'}),
+        dash_table.DataTable(
+            id='compare-table',
+            columns=[{'name': name, 'id': column} for column, name in COLUMNS],
+            style_table={'overflowX': 'auto'}
+        )
+    ], style={'textAlign': 'center'})
+
+
+# Callback: align the selected series chunk by chunk in a background job
+@callback(
+    [Output('compare-graph', 'figure'),
+     Output('compare-table', 'data'),
+     Output('compare-output-div', 'children')],
+    [Input('compare-button', 'n_clicks')],
+    [State('compare-coil-dropdown', 'value'),
+     State('compare-rxe-dropdown', 'value'),
+     State('compare-voltage-dropdown', 'value'),
+     State('compare-range-dropdown', 'value'),
+     State('compare-step-dropdown', 'value'),
+     State('compare-mode-radio', 'value')],
+    background=True,
+    manager=background_manager,
+    progress=[Output('compare-output-div', 'children')],
+    cache_args_to_ignore=[0],  # n_clicks
+    prevent_initial_call=True
+)
+def update_comparison(set_progress, n_clicks, selected_coils, selected_rxe, selected_voltage, selected_hours,
+                      step_seconds, mode):
+    if not selected_coils or not selected_rxe or not selected_voltage:
+        return comparison_figure({}), [], "Please make all selections."
+    series = [(coil, rxe, selected_voltage) for coil in selected_coils for rxe in selected_rxe]
+    if len(series) < 2:
+        return comparison_figure({}), [], "Select at least two coils or RXE options to compare."
+
+    def report(done, total):  # Shown below the graph until the comparison arrives
+        set_progress(html.P(f"Aligned {done} of {total} time chunks..."))
+    difference = mode == 'difference'
+    curves, statistics, errors = compare_series(series, selected_hours or None, step_seconds or None,
+                                                difference, progress=report)
+    with span('figure'):
+        figure = comparison_figure(curves, difference)
+    statistics = statistics.round(4).astype(object).where(statistics.notna(), None)
+    messages = [html.P(f"Error: {error}.") for error in errors]
+    if not curves:
+        messages.append(html.P("No data available for the selected options."))
+    return figure, statistics.to_dict('records'), html.Div(messages)
@@ -0,0 +1,62 @@
+import dash
+from dash import dcc, html, dash_table, Input, Output, callback
+from fleet_summary import SUMMARY_NAME, load_summary
+
+# Register the page
+dash.register_page(__name__)
+
+# Columns shown in the table, with their headers
+COLUMNS = [
+    ('coil', 'Coil'), ('channel', 'RXE'), ('parameter', 'Voltage'), ('date', 'Date'), ('segments', 'Files'),
+    ('count', 'Samples'), ('mean', 'Mean'), ('min', 'Min'), ('max', 'Max'),
+    ('p1', 'P1'), ('p50', 'Median'), ('p99', 'P99'), ('gaps', 'Gaps'),
+    ('gap_seconds', 'Gap time (s)'), ('out_of_range', 'Out of range'),
+    ('excursion', 'Excursions'), ('stuck', 'Stuck'), ('step', 'Steps'), ('drift', 'Drifts'),
+    ('stale', 'Changed since scan'),
+]
+
+# Layout
+layout = html.Div([
+    html.P("Fleet summary of all coil logs, as written by fleet_summary.py"),
+    dcc.Dropdown(
+        id='fleet-coil-dropdown',
+        multi=True,
+        placeholder="All coils",
+        style={'width': '50%', 'margin': '0 auto'}
+    ),
+    html.Button('Reload', id='fleet-reload-button', n_clicks=0, style={'marginTop': '20px'}),
+    html.Hr(style={'border': '3px solid blue', 'margin': '10px auto', 'width': '60%'}),
+    html.Div(id='fleet-output-div', style={'marginTop': '20px'}),
+    dash_table.DataTable(
+        id='fleet-table',
+        columns=[{'name': name, 'id': column} for column, name in COLUMNS],
+        sort_action='native',
+        filter_action='native',
+        page_size=50,
+        style_table={'overflowX': 'auto'}
+    )
+], style={'textAlign': 'center'})
+
+
+# Callback: read the summary table, nothing is parsed here
+@callback(
+    [Output('fleet-table', 'data'),
+     Output('fleet-coil-dropdown', 'options'),
+     Output('fleet-output-div', 'children')],
+    [Input('fleet-coil-dropdown', 'value'),
+     Input('fleet-reload-button', 'n_clicks')]
+)
+def update_fleet_table(selected_coils, n_clicks):
+    table = load_summary('.')
+    if table is None:
+        return [], [], f"No {SUMMARY_NAME} found. Run 'python fleet_summary.py <log directory>' first."
+
+    options = [{'label': coil, 'value': coil} for coil in sorted(table['coil'].unique())]
+    if selected_coils:
+        table = table[table['coil'].isin(selected_coils)]
+    table = table.round({column: 3 for column in ['mean', 'min', 'max', 'p1', 'p50', 'p99', 'gap_seconds']})
+    table['stale'] = table['stale'].map({True: 'yes', False: ''})
+    message = f"{len(table)} logs"
+    if table['error'].notna().any():
+        message += f", {int(table['error'].notna().sum())} could not be read"
+    return table[[column for column, _ in COLUMNS]].to_dict('records'), options, message
@@ -1,10 +1,13 @@
 
-import os
+import io
 import base64
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import dash
-from dash import dcc, html, Input, Output, State, callback
+from dash import dcc, html, Input, Output, State, MATCH, callback, clientside_callback
+from coil_functions import read_log
+from downsample import downsample_window
 
 # Register the page
 dash.register_page(__name__)
@@ -56,67 +59,77 @@ layout = html.Div(
     style={'backgroundColor': '#F5F5F5', 'padding': '30px', 'fontFamily': 'Arial, sans-serif'}
 )
 
-# Callback
-@callback(
+# Split the upload in the browser into one store per file, so every file is
+# sent to the server on its own and its card and graph appear once it is parsed
+clientside_callback(
+    """
+    function(contents, filenames) {
+        if (!contents) {
+            return ["No files uploaded yet.", []];
+        }
+        const cards = [];
+        const graphs = [];
+        contents.forEach(function(content, index) {
+            const filename = filenames[index];
+            // Skip files containing "_err" in the filename
+            if (filename.includes("_err")) {
+                return;
+            }
+            cards.push({namespace: "dash_html_components", type: "Div", props: {
+                id: {type: "upload-card", index: index},
+                style: {backgroundColor: "#ECF0F1", padding: "15px", borderRadius: "8px"},
+                children: [
+                    {namespace: "dash_html_components", type: "H3", props: {
+                        children: "File: " + filename + " (loading...)", style: {color: "#3498DB"}}},
+                    {namespace: "dash_core_components", type: "Store", props: {
+                        id: {type: "upload-file", index: index}, data: {filename: filename, content: content}}}
+                ]
+            }});
+            graphs.push({namespace: "dash_html_components", type: "Div", props: {
+                id: {type: "upload-graph", index: index}}});
+        });
+        return [cards, graphs];
+    }
+    """,
     [Output('file-info', 'children'), Output('graphs-container', 'children')],
     [Input('upload-data', 'contents')],
     [Input('upload-data', 'filename')]
 )
-def update_output(contents, filenames):
-    if contents is None:
-        return "No files uploaded yet.", []
-
-    try:
-        graphs = []
-        file_info = []
-
-        # Process each uploaded file
-        for content, filename in zip(contents, filenames):
-            # Skip files containing "_err" in the filename
-            if "_err" in filename:
-                continue
-
-            # Decode the uploaded file contents
-            content_type, content_string = content.split(',')
-            decoded = base64.b64decode(content_string)
-
-            # Save the uploaded file to a temporary location
-            temp_file = f"uploaded_{filename}"
-            with open(temp_file, 'wb') as f:
-                f.write(decoded)
-
-            # Load the CSV file into a DataFrame
-            df = pd.read_csv(temp_file, skiprows=9, sep='\t', names=['date', 'time', 'value'])
 
-            # Combine date and time into a single datetime column
-            df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'])
 
-            # Calculate basic statistics
-            mean_value = df['value'].mean()
-            min_value = df['value'].min()
-            max_value = df['value'].max()
-
-            # File information and statistics
-            file_info.append(html.Div(
-                [
-                    html.H3(f"File: {filename}", style={'color': '#3498DB'}),
-                    html.P(f"Mean Value: {mean_value:.6f}", style={'fontSize': '16px'}),
-                    html.P(f"Minimum Value: {min_value:.6f}", style={'fontSize': '16px'}),
-                    html.P(f"Maximum Value: {max_value:.6f}", style={'fontSize': '16px'}),
-                    html.Hr(style={'borderColor': '#3498DB', 'borderWidth': '2px'}),
-                ],
-                style={'backgroundColor': '#ECF0F1', 'padding': '15px', 'borderRadius': '8px'}
-            ))
-
-            # Create a Plotly Express line graph
-            fig = px.line(df, x='datetime', y='value', title=f'Data Plot: {filename}')
-            graphs.append(dcc.Graph(figure=fig))
-
-            # Clean up the temporary file
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-
-        return file_info, graphs
+# Callback for one uploaded file
+@callback(
+    [Output({'type': 'upload-card', 'index': MATCH}, 'children'),
+     Output({'type': 'upload-graph', 'index': MATCH}, 'children')],
+    [Input({'type': 'upload-file', 'index': MATCH}, 'data')]
+)
+def update_output(upload):
+    filename = upload['filename']
+    try:
+        # Decode the uploaded file contents and parse them straight from memory
+        content_type, content_string = upload['content'].split(',')
+        decoded = base64.b64decode(content_string)
+        # Values in float64 so the statistics show every digit of the logged values
+        df = read_log(io.BytesIO(decoded), absolute=False, dtype=np.float64)
+
+        # Calculate basic statistics
+        mean_value = df['value'].mean()
+        min_value = df['value'].min()
+        max_value = df['value'].max()
+
+        # File information and statistics
+        file_info = [
+            html.H3(f"File: {filename}", style={'color': '#3498DB'}),
+            html.P(f"Mean Value: {mean_value:.6f}", style={'fontSize': '16px'}),
+            html.P(f"Minimum Value: {min_value:.6f}", style={'fontSize': '16px'}),
+            html.P(f"Maximum Value: {max_value:.6f}", style={'fontSize': '16px'}),
+            html.Hr(style={'borderColor': '#3498DB', 'borderWidth': '2px'}),
+        ]
+
+        # Create a Plotly Express line graph of the downsampled series
+        x, y = downsample_window(df['datetime'], df['value'])
+        fig = px.line(pd.DataFrame({'datetime': x, 'value': y}), x='datetime', y='value', title=f'Data Plot: {filename}')
+        return file_info, dcc.Graph(figure=fig)
 
     except Exception as e:
-        return html.P(f"Error: {e}"), []
+        return [html.H3(f"File: {filename}", style={'color': '#3498DB'}), html.P(f"Error: {e}")], []
@@ -0,0 +1,51 @@
+import os
+import pytest
+from log_catalog import LogCatalog, parse_log_name
+
+# Log names are compared token by token, not as substrings.
+
+
+@pytest.mark.parametrize('name, key', [
+    ('KNEE8_MSEQ0_VDH_2024-11-05.txt', ('KNEE8', 'MSEQ0', 'VDH', '2024-11-05')),
+    ('KNEE_16_MSEQ1_VLNA_20241105.txt', ('KNEE_16', 'MSEQ1', 'VLNA', '2024-11-05')),
+    ('KNEE8X_MSEQ0_VDH.txt', ('KNEE8X', 'MSEQ0', 'VDH', '')),
+    ('KNEE8_VDH_MSEQ0.txt', ('KNEE8', 'MSEQ0', 'VDH', '')),             # Parameter before the channel
+    ('KNEE_16_VDL_MSEQ1_2024-11-05.txt', ('KNEE_16', 'MSEQ1', 'VDL', '2024-11-05')),
+    ('KNEE8_MSEQ0_VDH_2024-11-05.txt.1.gz', ('KNEE8', 'MSEQ0', 'VDH', '2024-11-05')),
+    ('README.txt', None),
+    ('MSEQ0_VDH.txt', None),
+    ('KNEE8_MSEQ0.txt', None),
+    ('.KNEE8_MSEQ0_VDH.txt', None),
+])
+def test_parse_log_name(name, key):
+    assert parse_log_name(name) == key
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    for name in ['KNEE8_MSEQ0_VDH_2024-11-05.txt', 'KNEE8X_MSEQ0_VDH_2024-11-06.txt',
+                 'KNEE8_MSEQ0_VDL_2024-11-05.txt', 'KNEE8_MSEQ0_VDLX_2024-11-06.txt',
+                 'KNEE8_VLNA_MSEQ1.txt', 'notes.txt']:
+        (tmp_path / name).write_text('')
+    return LogCatalog(str(tmp_path))
+
+
+def test_coil_is_not_matched_by_prefix(catalog):
+    # 'KNEE8' is a prefix of 'KNEE8X', whose log is newer
+    assert os.path.basename(catalog.lookup('KNEE8', 'MSEQ0', 'VDH')) == 'KNEE8_MSEQ0_VDH_2024-11-05.txt'
+    assert os.path.basename(catalog.lookup('KNEE8X', 'MSEQ0', 'VDH')) == 'KNEE8X_MSEQ0_VDH_2024-11-06.txt'
+    assert catalog.lookup('KNEE', 'MSEQ0', 'VDH') is None
+
+
+def test_parameter_is_not_matched_by_prefix(catalog):
+    assert os.path.basename(catalog.lookup('KNEE8', 'MSEQ0', 'VDL')) == 'KNEE8_MSEQ0_VDL_2024-11-05.txt'
+    assert os.path.basename(catalog.lookup('KNEE8', 'MSEQ0', 'VDLX')) == 'KNEE8_MSEQ0_VDLX_2024-11-06.txt'
+    assert catalog.lookup('KNEE8', 'MSEQ0', 'VD') is None
+    assert catalog.parameters('KNEE8', 'MSEQ0') == ['VDH', 'VDL', 'VDLX']
+
+
+def test_parameter_before_channel(catalog, capsys):
+    assert os.path.basename(catalog.lookup('KNEE8', 'MSEQ1', 'VLNA')) == 'KNEE8_VLNA_MSEQ1.txt'
+    assert catalog.coils() == ['KNEE8', 'KNEE8X']
+    # Log files that can't be parsed are reported
+    assert 'notes.txt' in capsys.readouterr().out
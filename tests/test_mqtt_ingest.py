@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+import coil_functions
+from mqtt_ingest import MqttIngest, RingBuffer, RingStore
+from coil_functions import File, File_2
+
+# MqttIngest with an in-process fake client: messages are handed to
+# on_message directly, as the paho network thread would.
+
+
+class FakeClient:
+    # The parts of the paho client interface MqttIngest uses
+
+    def __init__(self):
+        self.on_connect = None
+        self.on_message = None
+        self.subscriptions = []
+
+    def subscribe(self, topic):
+        self.subscriptions.append(topic)
+
+    def connect_async(self, host, port):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+def message(topic, *rows):
+    return SimpleNamespace(topic=topic, payload=''.join(f"{row}\n" for row in rows).encode())
+
+
+def row(seconds, value):
+    timestamp = pd.Timestamp('2024-11-05') + pd.Timedelta(seconds=seconds)
+    return f"{timestamp:%Y-%m-%d}\t{timestamp:%H:%M:%S.%f}\t{value}"
+
+
+def ns(seconds):
+    return (pd.Timestamp('2024-11-05') + pd.Timedelta(seconds=seconds)).value
+
+
+def test_on_message_fills_ring_buffers():
+    store = RingStore(capacity=100)
+    client = FakeClient()
+    ingest = MqttIngest(store, host='', client=client)
+    ingest.start()
+    ingest.on_connect(client, None, {}, 0)
+    client.on_message(client, None, message('procoil/KNEE_16/MSEQ0/VDH', row(0, -5.5), row(1, 5.25)))
+    client.on_message(client, None, message('procoil/KNEE_16/MSEQ0/VDH', row(2, 5.75)))
+    client.on_message(client, None, message('procoil/KNEE_16/MSEQ1/VDL', row(0, 3.3)))
+    client.on_message(client, None, message('other/KNEE_16/MSEQ0/VDH', row(3, 1.0)))
+    client.on_message(client, None, message('procoil/KNEE_16/MSEQ2/VDH', 'not a row'))
+    ingest.stop()  # Waits until the queue is worked off
+
+    assert client.subscriptions == ['procoil/+/+/+']
+    assert store.series() == [('KNEE_16', 'MSEQ0', 'VDH'), ('KNEE_16', 'MSEQ1', 'VDL')]
+    df = store.frame('KNEE_16', 'MSEQ0', 'VDH', 'voltage')
+    assert df['datetime'].tolist() == [pd.Timestamp(ns(seconds)) for seconds in (0, 1, 2)]
+    assert df['voltage'].tolist() == [5.5, 5.25, 5.75]  # Absolute values, like the logs
+    stats = ingest.stats()
+    assert stats['received'] == 5
+    assert stats['samples'] == 4
+    assert stats['rejected'] == 2
+    assert stats['dropped'] == 0
+
+
+def test_full_queue_drops_messages():
+    # Without the worker running nothing is taken off the queue
+    ingest = MqttIngest(RingStore(capacity=10), host='', client=FakeClient(), queue_size=3)
+    for seconds in range(5):
+        ingest.on_message(None, None, message('procoil/KNEE_16/MSEQ0/VDH', row(seconds, 1.0)))
+    assert ingest.received == 5
+    assert ingest.dropped == 2
+    assert ingest.queue.qsize() == 3
+
+
+def test_ring_buffer_overwrites_oldest_samples():
+    buffer = RingBuffer(capacity=5)
+    buffer.extend(np.array([ns(s) for s in range(3)]), [0, 1, 2])
+    buffer.extend(np.array([ns(s) for s in range(3, 7)]), [3, 4, 5, 6])
+    assert buffer.count == 5
+    assert buffer.overwritten == 2
+    timestamps, values = buffer.snapshot()
+    assert timestamps.tolist() == [ns(s) for s in range(2, 7)]
+    assert values.tolist() == [2, 3, 4, 5, 6]
+
+    # A batch larger than the buffer keeps its newest samples
+    buffer.extend(np.array([ns(s) for s in range(7, 19)]), list(range(7, 19)))
+    assert buffer.overwritten == 14
+    timestamps, values = buffer.snapshot()
+    assert np.all(np.diff(timestamps) > 0)
+    assert values.tolist() == [14, 15, 16, 17, 18]
+
+
+@pytest.fixture
+def mqtt_series(tmp_path, monkeypatch):
+    # A series received over MQTT that has no log file in the data directory
+    # held in a store of its own, so nothing leaks into the shared ring_store
+    monkeypatch.chdir(tmp_path)
+    store = RingStore()
+    monkeypatch.setattr(coil_functions, 'ring_store', store)
+    buffer = store.buffer('TEST_COIL', 'MSEQ0', 'VDH', create=True)
+    buffer.extend(np.array([ns(s) for s in range(10)]), [float(s) for s in range(10)])
+    return ('TEST_COIL', 'MSEQ0', 'VDH')
+
+
+def test_file_falls_back_to_ring_store(mqtt_series):
+    df = File(*mqtt_series)
+    assert len(df) == 10
+    assert df['voltage'].tolist() == [float(s) for s in range(10)]
+
+    df = File(*mqtt_series, time_hm=True, start=pd.Timestamp(ns(2)), end=pd.Timestamp(ns(5)))
+    assert df['voltage'].tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert df['time_hm'].tolist() == ['00:00'] * 4
+
+    df = File_2(*mqtt_series, start=pd.Timestamp(ns(8)))
+    assert df['parameter'].tolist() == [8.0, 9.0]
+
+    assert File('TEST_COIL', 'MSEQ1', 'VDH') == "No matching file found"
+    assert File_2('TEST_COIL', 'MSEQ1', 'VDH') == "No matching file found"